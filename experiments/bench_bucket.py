@@ -0,0 +1,75 @@
+#####
+# age_map / year_of_publication_map 의 row 단위 apply 와 np.digitize bucket 비교
+# 학습 306,795 + 테스트 76,699 = 383,494 행 (조인된 context frame 크기) 기준
+# ex) python experiments/bench_bucket.py
+
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.data.bucket import age_bucket, year_of_publication_bucket
+
+
+# 기존 context_data.py 의 row 단위 구현
+def legacy_age_map(x: int) -> int:
+    x = int(x)
+    if x < 20:
+        return 1
+    elif x >= 20 and x < 30:
+        return 2
+    elif x >= 30 and x < 40:
+        return 3
+    elif x >= 40 and x < 50:
+        return 4
+    elif x >= 50 and x < 60:
+        return 5
+    else:
+        return 6
+
+
+def legacy_year_of_publication_map(x: int) -> int:
+    x = int(x)
+    if x < 1991:
+        return 1
+    elif x >= 1991 and x < 1996:
+        return 2
+    elif x >= 1996 and x < 2000:
+        return 3
+    else:
+        return 4
+
+
+def bench(fn, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    n_rows = 306795 + 76699
+    rng = np.random.default_rng(42)
+    df = pd.DataFrame({
+        'age': rng.integers(5, 100, n_rows).astype(np.float64),
+        'year_of_publication': rng.integers(1900, 2007, n_rows).astype(np.float64),
+    })
+
+    for column, row_fn, column_fn in (
+        ('age', legacy_age_map, age_bucket),
+        ('year_of_publication', legacy_year_of_publication_map, year_of_publication_bucket),
+    ):
+        apply_time, expected = bench(lambda: df[column].apply(row_fn).values)
+        bucket_time, result = bench(lambda: column_fn(df[column]))
+        assert np.array_equal(expected, result)
+        print(f"[{column}] rows: {n_rows}, apply: {apply_time * 1000:.1f}ms, "
+              f"bucket: {bucket_time * 1000:.1f}ms, speedup: {apply_time / bucket_time:.0f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,4 @@
 #!/bin/bash
 
-for USER_NUM in 1 2 3 4 5 6 7 8 9
-do
-	for BOOK_NUM in 1 2 3 4 5 6 7 8 9 10 11 12 13 14 15 16 17 18 19 20 21 22 23 24
-	do
-		python main.py --USER_NUM ${USER_NUM} --BOOK_NUM ${BOOK_NUM} --MODEL NCF --VALID random
-	done
-done
\ No newline at end of file
+# USER_NUM 1~9 x BOOK_NUM 1~24 를 NCF 로 한 번에 돌려서 eda_select_top_1.csv 에 rmse 를 남깁니다.
+python sweep.py --MODELS NCF --RESULTS eda_select_top_1.csv "$@"
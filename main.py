@@ -3,8 +3,9 @@ import time
 import argparse
 import pandas as pd
 import numpy as np
+import torch
 
-from src import seed_everything
+from src import seed_everything, run_folds
 
 from src.data import context_data_load, context_data_split, context_data_loader
 from src.data import dl_data_load, dl_data_split, dl_data_loader
@@ -18,7 +19,8 @@ from src import DeepCoNN
 
 from src import XGBoostModel, LightGBMModel, CatBoostModel
 
-from sklearn.model_selection import StratifiedKFold
+from src.data.folds import FoldPlan, FoldView
+from src.data.lazy import LazyData
 
 
 class StandardScaler:
@@ -34,6 +36,89 @@ class StandardScaler:
         return (df - self.train_mean) / self.train_std
 
 
+def fold_data(args, data) -> LazyData:
+    """
+    run_folds 로 넘길 fold 학습 입력. data dict 전체(users / books / ContextTable ...) 대신
+    평점 코드, (user_id, isbn) 행, context 행렬 같은 tensor 만 담아서 process pool 에는 shared memory 로 넘어갑니다.
+    """
+    fold = LazyData({'rating': torch.tensor(data['train']['rating'].values), 'field_dims': data['field_dims']})
+    if args.MODEL in ('XGB', 'LGBM', 'CATB'):
+        fold['fold_X'] = FoldView.from_frame(data['train'].drop(['rating'], axis = 1))
+        # GBM 은 DataFrame 으로 학습하므로 test 는 처음 쓸 때 frame 으로 모음
+        fold.lazy('test', FoldView.frame, FoldView.from_frame(data['test']))
+    else:
+        fold['fold_X'] = data['context'].rows(data['train'].drop(['rating'], axis = 1))
+        fold['test'] = data['context'].rows(data['test'])
+    return fold
+
+
+def context_fold(args, data, idx, train_index, valid_index):
+    """
+    FM / FFM / XGB / LGBM / CATB 의 한 fold 학습. return: (valid rmse, test 예측)
+    """
+    X = data['fold_X']
+    data['X_train'], data['X_valid'] = X.rows(train_index), X.rows(valid_index)
+    if args.MODEL not in ('FM', 'FFM'):
+        data['X_train'], data['X_valid'] = data['X_train'].frame(), data['X_valid'].frame()
+    data['y_train'] = pd.Series(data['rating'][train_index].numpy())
+    data['y_valid'] = pd.Series(data['rating'][valid_index].numpy())
+    data = context_data_loader(args, data)
+
+    print(f'--------------- FOLD-{idx}, INIT {args.MODEL} ---------------')
+    if args.MODEL=='FM':
+        model = FactorizationMachineModel(args, data)
+    elif args.MODEL=='FFM':
+        model = FieldAwareFactorizationMachineModel(args, data)
+    elif args.MODEL=='XGB':
+        model = XGBoostModel(args, data)
+    elif args.MODEL=='LGBM':
+        model = LightGBMModel(args, data)
+    elif args.MODEL=='CATB':
+        model = CatBoostModel(args, data)
+    else:
+        pass
+    
+    print(f'--------------- FOLD-{idx}, {args.MODEL} TRAINING ---------------')
+    rmse_score = model.train(fold_num = idx)
+    
+    print(f'--------------- FOLD-{idx}, {args.MODEL} PREDICT ---------------')
+    return rmse_score, np.array(model.predict(data['test_dataloader']))
+
+
+def dl_fold(args, data, idx, train_index, valid_index):
+    """
+    NCF / WDN / DCN 의 한 fold 학습. return: (valid rmse, test 예측)
+    """
+    X = data['fold_X']
+    data['X_train'], data['X_valid'] = X.rows(train_index), X.rows(valid_index)
+    data['y_train'] = pd.Series(data['rating'][train_index].numpy())
+    data['y_valid'] = pd.Series(data['rating'][valid_index].numpy())
+    scaler = StandardScaler()
+    scaler.build(data['y_train'])
+    data['y_train'] = scaler.normalize(data['y_train'])
+    data['y_valid'] = scaler.normalize(data['y_valid'])
+    data['scaler'] = scaler
+    # print(data['X_train'].sample(5))
+    data = dl_data_loader(args, data)
+
+    print(f'--------------- FOLD-{idx}, INIT {args.MODEL} ---------------')
+    if args.MODEL=='NCF':
+        model = NeuralCollaborativeFiltering(args, data)
+    elif args.MODEL=='WDN':
+        model = WideAndDeepModel(args, data)
+    elif args.MODEL=='DCN':
+        model = DeepCrossNetworkModel(args, data)
+    
+    print(f'--------------- FOLD-{idx}, {args.MODEL} TRAINING ---------------')
+    rmse_score = model.train(fold_num = idx)
+    
+    print(f'--------------- FOLD-{idx}, {args.MODEL} PREDICT ---------------')
+    prediction = np.array(model.predict(data['test_dataloader']))
+    if args.SCALER:
+        prediction = prediction * scaler.train_std + scaler.train_mean
+    return rmse_score, prediction
+
+
 def main(args):
     seed_everything(args.SEED)
 
@@ -143,7 +228,6 @@ def main(args):
             pass
 
     elif args.VALID == 'kfold':
-        skf = StratifiedKFold(n_splits = args.N_SPLITS, shuffle = True)
         length = len(data['test'])
         kfold_predicts = np.zeros((args.N_SPLITS, length))
         rmse_array = np.zeros(args.N_SPLITS)
@@ -154,37 +238,10 @@ def main(args):
             print('with rmse loss')
 
         if args.MODEL in ('FM', 'FFM', 'XGB', 'LGBM', 'CATB'):
-            for idx, (train_index, valid_index) in enumerate(skf.split(
-                                                data['train'].drop(['rating'], axis = 1),
-                                                data['train']['rating']
-                                                )):
-                
-                data['X_train']= data['train'].drop(['rating'], axis = 1).iloc[train_index]
-                data['y_train'] = data['train']['rating'].iloc[train_index]
-                data['X_valid']= data['train'].drop(['rating'], axis = 1).iloc[valid_index]
-                data['y_valid'] = data['train']['rating'].iloc[valid_index]
-                data = context_data_loader(args, data)
-
-                print(f'--------------- FOLD-{idx}, INIT {args.MODEL} ---------------')
-                if args.MODEL=='FM':
-                    model = FactorizationMachineModel(args, data)
-                elif args.MODEL=='FFM':
-                    model = FieldAwareFactorizationMachineModel(args, data)
-                elif args.MODEL=='XGB':
-                    model = XGBoostModel(args, data)
-                elif args.MODEL=='LGBM':
-                    model = LightGBMModel(args, data)
-                elif args.MODEL=='CATB':
-                    model = CatBoostModel(args, data)
-                else:
-                    pass
-                
-                print(f'--------------- FOLD-{idx}, {args.MODEL} TRAINING ---------------')
-                rmse_score = model.train(fold_num = idx)
+            plan = FoldPlan(args, data['train']['rating'])
+            for idx, (rmse_score, prediction) in enumerate(run_folds(args, fold_data(args, data), plan, context_fold)):
                 rmse_array[idx] = rmse_score
-                
-                print(f'--------------- FOLD-{idx}, {args.MODEL} PREDICT ---------------')
-                kfold_predicts[idx] = np.array(model.predict(data['test_dataloader']))
+                kfold_predicts[idx] = prediction
             
             
             
@@ -206,38 +263,9 @@ def main(args):
                 pass
         
         elif args.MODEL in ('NCF', 'WDN', 'DCN'):
-            for idx, (train_index, valid_index) in enumerate(skf.split(
-                                                data['train'].drop(['rating'], axis = 1),
-                                                data['train']['rating']
-                                                )):
-                data['X_train']= data['train'].drop(['rating'], axis = 1).iloc[train_index]
-                data['y_train'] = data['train']['rating'].iloc[train_index]
-                data['X_valid']= data['train'].drop(['rating'], axis = 1).iloc[valid_index]
-                data['y_valid'] = data['train']['rating'].iloc[valid_index]
-                scaler = StandardScaler()
-                scaler.build(data['y_train'])
-                data['y_train'] = scaler.normalize(data['y_train'])
-                data['y_valid'] = scaler.normalize(data['y_valid'])
-                data['scaler'] = scaler
-                # print(data['X_train'].sample(5))
-                data = dl_data_loader(args, data)
-
-                print(f'--------------- FOLD-{idx}, INIT {args.MODEL} ---------------')
-                if args.MODEL=='NCF':
-                    model = NeuralCollaborativeFiltering(args, data)
-                elif args.MODEL=='WDN':
-                    model = WideAndDeepModel(args, data)
-                elif args.MODEL=='DCN':
-                    model = DeepCrossNetworkModel(args, data)
-                
-                print(f'--------------- FOLD-{idx}, {args.MODEL} TRAINING ---------------')
-                rmse_score = model.train(fold_num = idx)
+            plan = FoldPlan(args, data['train']['rating'])
+            for idx, (rmse_score, prediction) in enumerate(run_folds(args, fold_data(args, data), plan, dl_fold)):
                 rmse_array[idx] = rmse_score
-                
-                print(f'--------------- FOLD-{idx}, {args.MODEL} PREDICT ---------------')
-                prediction = np.array(model.predict(data['test_dataloader']))
-                if args.SCALER:
-                    prediction = prediction * scaler.train_std + scaler.train_mean
                 kfold_predicts[idx] = prediction
             
             print(f'--------------- FOLD-{idx}, SAVE {args.MODEL} PREDICT ---------------')
@@ -258,13 +286,11 @@ def main(args):
                 pass
         
         elif args.MODEL == 'CNN_FM':
-            for idx, (train_index, valid_index) in enumerate(skf.split(
-                                                data['img_train'][['user_id', 'isbn', 'img_vector']],
-                                                data['img_train']['rating']
-                                                )):
-                data['X_train']= data['img_train'][['user_id', 'isbn', 'img_vector']].iloc[train_index]
+            plan = FoldPlan(args, data['img_train']['rating'])
+            X = FoldView.from_frame(data['img_train'][['user_id', 'isbn', 'img_index']])
+            for idx, (train_index, valid_index) in enumerate(plan.split()):
+                data['X_train'], data['X_valid'] = X.rows(train_index), X.rows(valid_index)
                 data['y_train'] = data['img_train']['rating'].iloc[train_index]
-                data['X_valid']= data['img_train'][['user_id', 'isbn', 'img_vector']].iloc[valid_index]
                 data['y_valid'] = data['img_train']['rating'].iloc[valid_index]
                 data = image_data_loader(args, data)
                 scaler = data['scaler']
@@ -294,13 +320,11 @@ def main(args):
                 pass
         
         elif args.MODEL == 'DeepCoNN':
-            for idx, (train_index, valid_index) in enumerate(skf.split(
-                                                data['text_train'].drop(['rating'], axis=1),
-                                                data['text_train']['rating']
-                                                )):
-                data['X_train']= data['text_train'][data['columns'] + ['user_summary_merge_vector', 'item_summary_vector'] + ['item_title_vector', 'item_image_vector']].iloc[train_index]
+            plan = FoldPlan(args, data['text_train']['rating'])
+            X = FoldView.from_frame(data['text_train'][data['columns']])
+            for idx, (train_index, valid_index) in enumerate(plan.split()):
+                data['X_train'], data['X_valid'] = X.rows(train_index), X.rows(valid_index)
                 data['y_train'] = data['text_train']['rating'].iloc[train_index]
-                data['X_valid']= data['text_train'][data['columns'] + ['user_summary_merge_vector', 'item_summary_vector']+ ['item_title_vector', 'item_image_vector']].iloc[valid_index]
                 data['y_valid'] = data['text_train']['rating'].iloc[valid_index]
                 scaler = StandardScaler()
                 scaler.build(data['y_train'])
@@ -355,7 +379,7 @@ def main(args):
 
 
 
-if __name__ == "__main__":
+def get_parser():
 
     ######################## BASIC ENVIRONMENT SETUP
     parser = argparse.ArgumentParser(description='parser')
@@ -363,6 +387,7 @@ if __name__ == "__main__":
 
     ############### BASIC OPTION
     arg('--DATA_PATH', type=str, default='/opt/ml/data/', help='Data path를 설정할 수 있습니다.')
+    arg('--DATA_SERVER', type=str, default=None, help='src.data.server 의 Unix socket 경로입니다. 떠 있으면 인코딩된 데이터를 공유 메모리에서 읽습니다.')
     arg('--SAVE_PATH', type = str, default = '/opt/ml/weights/', help = "학습된 모델들이 저장되는 path입니다.")
     arg('--USER_NUM', type = int, help = "user data preprocessed number `1 ~ 9`")
     arg('--BOOK_NUM', type = int, help = "book data preprocessed number `1 ~ 24`")
@@ -374,6 +399,8 @@ if __name__ == "__main__":
     arg('--SEED', type=int, default=42, help='seed 값을 조정할 수 있습니다.')
     arg('--VALID', type = str, default = 'kfold', help = "kfold, random")
     arg('--N_SPLITS', type = int, default = 5)
+    arg('--N_JOBS', type = int, default = 1, help = 'kfold 에서 동시에 학습할 fold(process) 수입니다. (FM/FFM/NCF/WDN/DCN/GBM)')
+    arg('--NUM_THREADS', type = int, default = -1, help = 'GBM 학습 thread 수입니다. -1 이면 모든 core (kfold --N_JOBS 에서는 process 마다 나눠서 자동으로 정함)')
     arg('--WEIGHTED_SAMPLER', type = bool, default = False)
     arg('--CLASSIFIER', type = bool, default = False)
     arg('--SCALER', type = bool, default = False)
@@ -443,7 +470,10 @@ if __name__ == "__main__":
     
     ############### CatBoost
     arg('--CATB_RR_CL', type=str, default='rr', help='CATB regression(rr), classifier(cl) 중 선택합니다. 기본 rr.')
-    
 
-    args = parser.parse_args()
+    return parser
+
+
+if __name__ == "__main__":
+    args = get_parser().parse_args()
     main(args)
@@ -23,7 +23,7 @@ from src import NeuralCollaborativeFiltering
 
 from src import XGBoostModel, LightGBMModel, CatBoostModel
 
-from sklearn.model_selection import StratifiedKFold
+from src.data.folds import FoldPlan
 
 def rmse(real: list, predict: list) -> float:
     pred = np.array(predict)
@@ -183,20 +183,18 @@ def main(args):
         
 
     elif args.VALID == 'kfold':
-        skf = StratifiedKFold(n_splits = args.N_SPLITS, shuffle = True)
+        plan = FoldPlan(args, data['train']['rating'])
+        X = data['train'].drop(['rating'], axis = 1)
         length = len(data['test'])
         kfold_predicts = np.zeros((args.N_SPLITS, length))
         rmse_array = np.zeros(args.N_SPLITS)
 
 
-        for idx, (train_index, valid_index) in enumerate(skf.split(
-                                            data['train'].drop(['rating'], axis = 1),
-                                            data['train']['rating']
-                                            )):
+        for idx, (train_index, valid_index) in enumerate(plan.split()):
             
-            data['X_train']= data['train'].drop(['rating'], axis = 1).iloc[train_index]
+            data['X_train']= X.iloc[train_index]
             data['y_train'] = data['train']['rating'].iloc[train_index]
-            data['X_valid']= data['train'].drop(['rating'], axis = 1).iloc[valid_index]
+            data['X_valid']= X.iloc[valid_index]
             data['y_valid'] = data['train']['rating'].iloc[valid_index]
 
             # 클래시피케이션 용 데이터로더 추가
@@ -318,6 +316,7 @@ if __name__ == "__main__":
 
     ############### BASIC OPTION
     arg('--DATA_PATH', type=str, default='/opt/ml/data/', help = 'Data path를 설정할 수 있습니다.')
+    arg('--DATA_SERVER', type=str, default=None, help='src.data.server 의 Unix socket 경로입니다. 떠 있으면 인코딩된 데이터를 공유 메모리에서 읽습니다.')
     arg('--SAVE_PATH', type = str, default = '/opt/ml/weights/', help = "학습된 모델들이 저장되는 path입니다.")
     arg('--USER_NUM', type = int, help = "user data preprocessed number `1 ~ 9`")
     arg('--BOOK_NUM', type = int, help = "book data preprocessed number `1 ~ 24`")
@@ -342,6 +341,8 @@ if __name__ == "__main__":
     arg('--SEED', type=int, default=42, help='seed 값을 조정할 수 있습니다.')
     arg('--VALID', type = str, default = 'kfold', help = "kfold, random")
     arg('--N_SPLITS', type = int, default = 5)
+    arg('--NUM_THREADS', type = int, default = -1, help = 'GBM 학습 thread 수입니다. -1 이면 모든 core')
+    arg('--WEIGHTED_SAMPLER', type = bool, default = False)
     
     ############### TRAINING OPTION
     arg('--BATCH_SIZE', type=int, default=64, help='Batch size를 조정할 수 있습니다.')
@@ -4,7 +4,8 @@ import numpy as np
 # import matplotlib.pyplot as plt
 import os
 import re
-from tqdm import tqdm
+
+from variants import write_variants
 
 path = '/opt/ml/input/code/data/'
 books = pd.read_csv(path + 'books.csv')
@@ -12,6 +13,54 @@ users = pd.read_csv(path + 'users.csv')
 ratings = pd.read_csv(path + 'train_ratings.csv')
 test_ratings = pd.read_csv(path + 'test_ratings.csv')
 
+def category_high(category: pd.Series, keywords) -> pd.Series:
+    # keyword 를 포함하는 category 는 그 keyword 로 묶음. 여러 개 포함하면 목록에서 마지막 keyword 가 이깁니다.
+    # 뒤에서부터 lookahead 를 alternation 으로 이어서 정규식 한 번으로 마지막 keyword 를 찾고,
+    # category 문자열 종류별로 한 번만 계산해서 map 합니다. 포함하는 keyword 가 없으면 그대로 둡니다.
+    pattern = re.compile('|'.join(f'(?=.*({re.escape(keyword)}))' for keyword in reversed(keywords)), re.DOTALL)
+
+    def classify(value):
+        match = pattern.match(value)
+        return keywords[len(keywords) - match.lastindex] if match else value
+
+    return category.map({value: classify(value) for value in category.dropna().unique()})
+
+
+def publisher_fix(publisher: pd.Series, isbn_prefix: pd.Series, modify_list) -> pd.Series:
+    # modify_list 순서대로, 그 publisher 의 가장 흔한 isbn 앞 4자리를 찾아서
+    # 그 prefix 의 모든 책을 prefix 에서 가장 흔한 publisher 로 바꾸는 작업을
+    # (publisher, prefix) 별 개수만 들고 순서대로 흉내냅니다. 동률은 먼저 나온 값이 이깁니다.
+    # return: prefix -> 최종 publisher
+    rows = pd.DataFrame({'publisher': publisher.values, 'prefix': isbn_prefix.values, 'row': np.arange(len(publisher))})
+    prefix_rows = rows.groupby('prefix')['row'].agg(['size', 'min'])
+    pair_rows = rows.dropna(subset=['publisher']).groupby(['prefix', 'publisher'])['row'].agg(['size', 'min'])
+
+    # prefix -> {publisher: [개수, 첫 행]}, publisher -> {prefix: [개수, 첫 행]}
+    by_prefix, by_publisher = {}, {}
+    for (prefix, pub), size, first in zip(pair_rows.index, pair_rows['size'], pair_rows['min']):
+        by_prefix.setdefault(prefix, {})[pub] = [size, first]
+        by_publisher.setdefault(pub, {})[prefix] = [size, first]
+
+    def mode(counts):
+        return max(counts.items(), key=lambda item: (item[1][0], -item[1][1]))[0]
+
+    result = {}
+    for pub in modify_list:
+        if not by_publisher.get(pub):
+            continue
+        number = mode(by_publisher[pub])
+        if not by_prefix.get(number):
+            continue
+        right_publisher = mode(by_prefix[number])
+        for old_pub in by_prefix[number]:
+            del by_publisher[old_pub][number]
+        count = [prefix_rows.at[number, 'size'], prefix_rows.at[number, 'min']]
+        by_prefix[number] = {right_publisher: count}
+        by_publisher[right_publisher][number] = list(count)
+        result[number] = right_publisher
+    return pd.Series(result, dtype=object)
+
+
 def main():
     books.loc[books['language'] != 'en', 'summary'] = 'None'
     books.loc[books['language'] != 'en', 'book_title'] = 'None'
@@ -43,8 +92,7 @@ def main():
 'business','poetry','drama','literary','travel','motion picture','children','cook','literature','electronic',
 'humor','animal','bird','photograph','computer','house','ecology','family','architect','camp','criminal','language','india']
 
-    for category in categories1:
-        books.loc[books[books['category1'].str.contains(category,na=False)].index,'category_high1'] = category
+    books['category_high1'] = category_high(books['category1'], categories1)
     
     category_high_df1 = pd.DataFrame(books['category_high1'].value_counts()).reset_index()
     category_high_df1.columns = ['category1','count']
@@ -60,8 +108,7 @@ def main():
 'business','poetry','drama','literary','travel','motion picture','children','cook','literature','electronic',
 'humor','animal','bird','photograph','computer','house','ecology','family','architect','camp','criminal','language','india', 'sports', 'horror', 'health']
 
-    for category in categories2:
-        books.loc[books[books['category2'].str.contains(category,na=False)].index,'category_high2'] = category
+    books['category_high2'] = category_high(books['category2'], categories2)
     
     category_high_df2 = pd.DataFrame(books['category_high1'].value_counts()).reset_index()
     category_high_df2.columns = ['category2','count']
@@ -93,13 +140,10 @@ def main():
     publisher_count_df= pd.DataFrame(list(publisher_dict.items()),columns = ['publisher1','count'])
     publisher_count_df = publisher_count_df.sort_values(by=['count'], ascending = False)
     modify_list = publisher_count_df[publisher_count_df['count']>5].publisher1.values
-    for publisher1 in tqdm(modify_list):
-        try:
-            number = books[books['publisher1']==publisher1]['isbn'].apply(lambda x: x[:4]).value_counts().index[0]
-            right_publisher = books[books['isbn'].apply(lambda x: x[:4])==number]['publisher1'].value_counts().index[0]
-            books.loc[books[books['isbn'].apply(lambda x: x[:4])==number].index,'publisher1'] = right_publisher
-        except:
-            pass
+    isbn_prefix = books['isbn'].astype(str).str[:4]
+    prefix_publisher = publisher_fix(books['publisher1'], isbn_prefix, modify_list)
+    fix = isbn_prefix.isin(prefix_publisher.index)
+    books.loc[fix, 'publisher1'] = isbn_prefix[fix].map(prefix_publisher)
 
     books['publisher2'] = -1  # publisher 없는경우
 
@@ -120,20 +164,27 @@ def main():
     n_auth = 2
 
 
+    # b01 ~ b24: 경우의 수 별 컬럼 선택만 spec 으로 저장 (src/data/store.py 의 load_variant 가 메모리에서 고름)
+    variants = {}
     num = 1
     for i in range(n_year):
         for j in range(n_pub):
             for k in range(n_cat):
                 for l in range(n_auth):
                     formatted_num = format(num, '02')
-                    file = books[['isbn', 'book_title', f'book_author{l+1}', f'year_of_publication{i+1}',
-                     f'publisher{j+1}', 'img_url', 'language1', f'category{k+1}', 'summary1', 'img_path']]
-                    file.columns = [['isbn', 'book_title', 'book_author', 'year_of_publication',
-                     'publisher', 'img_url', 'language', 'category', 'summary', 'img_path']]
-
-
-                    file.to_csv(f'../../data/books/b{formatted_num}.csv', index=False)
+                    variants[f'b{formatted_num}'] = {
+                        'book_title': 'book_title',
+                        'book_author': f'book_author{l+1}',
+                        'year_of_publication': f'year_of_publication{i+1}',
+                        'publisher': f'publisher{j+1}',
+                        'img_url': 'img_url',
+                        'language': 'language1',
+                        'category': f'category{k+1}',
+                        'summary': 'summary1',
+                        'img_path': 'img_path',
+                    }
                     num += 1
+    write_variants(books, 'isbn', variants, '../../data/books', 'books_base')
 
 
 if __name__ == '__main__':
@@ -6,28 +6,127 @@ from tqdm import tqdm
 import pandas as pd
 import re
 import numpy as np
-import pickle
-
-NONE_TENSOR = np.load("/opt/ml/data/none_tensor.npy")
+import hashlib
+import argparse
 
+from variants import read_variant
+from embedding_store import write_embedding
 
-def embed_image(book_df, model, preprocess, device):
-    img_vector_df = book_df[['img_path']].drop_duplicates().reset_index(drop = True).copy()
-    data_box = []
-    for name in tqdm(img_vector_df['img_path']):
-        image_path = os.path.join("/opt/ml/input/code/data", name)
-        image = Image.open(image_path).convert('RGB')
-        image_input = preprocess(image).unsqueeze(0).to(device)
-        
+NONE_TENSOR = np.load("/opt/ml/data/none_tensor.npy")
+CLIP_MODEL = "ViT-B/32"
+CACHE_DIR = "/opt/ml/data/embedding/cache"
+
+
+class EmbeddingCache:
+    """
+    content hash(sha1) -> vector 를 {name}.keys.npy + {name}.npy 로 저장해두는 cache.
+    train / test 와 재실행 사이에 같은 내용(제목, 요약, 이미지)은 한 번만 encode 합니다.
+    """
+    def __init__(self, cache_dir, name):
+        self.keys_path = os.path.join(cache_dir, f'{name}.keys.npy')
+        self.vectors_path = os.path.join(cache_dir, f'{name}.npy')
+        self.vectors = {}
+        if os.path.exists(self.keys_path) and os.path.exists(self.vectors_path):
+            self.vectors = dict(zip(np.load(self.keys_path).tolist(), np.load(self.vectors_path)))
+
+    def __contains__(self, key):
+        return key in self.vectors
+
+    def update(self, keys, vectors):
+        self.vectors.update(zip(keys, vectors))
+
+    def get(self, keys) -> np.ndarray:
+        return np.stack([self.vectors[key] for key in keys])
+
+    def save(self):
+        if not self.vectors:
+            return
+        os.makedirs(os.path.dirname(self.keys_path), exist_ok=True)
+        np.save(self.keys_path, np.array(list(self.vectors.keys())))
+        np.save(self.vectors_path, np.stack(list(self.vectors.values())).astype(np.float32))
+
+
+def text_hash(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def file_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def encode_cached(keys, inputs, encode, cache):
+    """
+    cache 에 없는 key 만 (같은 key 는 한 번) encode 에 넘기고, keys 순서대로 (N, dim) 행렬을 돌려줍니다.
+    encode: 입력 리스트 -> 순서대로 (batch, dim) numpy 를 내는 iterator
+    """
+    todo = {}
+    for key, item in zip(keys, inputs):
+        if key not in cache and key not in todo:
+            todo[key] = item
+    todo_keys = list(todo)
+    print(f"{len(keys)} inputs, {len(set(keys))} unique, {len(todo_keys)} to encode")
+
+    start = 0
+    for vectors in encode([todo[key] for key in todo_keys]):
+        cache.update(todo_keys[start:start + len(vectors)], vectors)
+        start += len(vectors)
+    cache.save()
+    return cache.get(keys)
+
+
+def encode_tokens(model, tokens, device) -> np.ndarray:
+    with torch.no_grad():
+        return model.encode_text(tokens.to(device)).float().cpu().numpy()
+
+
+def text_batches(texts, model, device, batch_size):
+    for start in tqdm(range(0, len(texts), batch_size)):
+        batch = texts[start:start + batch_size]
+        # tokenize / encode 가 실패하는 (너무 긴, 깨진) 문장은 기존처럼 NONE_TENSOR
+        vectors = np.tile(NONE_TENSOR.astype(np.float32), (len(batch), 1))
+        tokens, ok = [], []
+        for i, text in enumerate(batch):
+            try:
+                tokens.append(clip.tokenize(text))
+                ok.append(i)
+            except Exception:
+                pass
+        if len(ok) < len(batch):
+            tqdm.write(f"[TEXT] batch {start}: {len(batch) - len(ok)} texts failed to tokenize -> NONE_TENSOR")
+        if tokens:
+            try:
+                vectors[ok] = encode_tokens(model, torch.cat(tokens), device)
+            except Exception as e:
+                # batch 하나가 실패해도 전체를 멈추지 않고 문장 단위로 다시 encode
+                tqdm.write(f"[TEXT] batch {start}: encode failed ({e!r}), retrying one by one")
+                for i, token in zip(ok, tokens):
+                    try:
+                        vectors[i] = encode_tokens(model, token, device)[0]
+                    except Exception:
+                        tqdm.write(f"[TEXT] text {start + i}: encode failed -> NONE_TENSOR")
+        yield vectors
+
+
+class ImageDataset(torch.utils.data.Dataset):
+    def __init__(self, paths, preprocess):
+        self.paths = paths
+        self.preprocess = preprocess
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, i):
+        return self.preprocess(Image.open(self.paths[i]).convert('RGB'))
+
+
+def image_batches(paths, model, preprocess, device, batch_size, num_workers):
+    # 이미지 decode / preprocess 는 worker 에서, encode 는 batch 단위로
+    loader = torch.utils.data.DataLoader(ImageDataset(paths, preprocess), batch_size=batch_size, num_workers=num_workers)
+    for image_input in tqdm(loader):
         with torch.no_grad():
-            image_features = model.encode_image(image_input)
-            image_features = image_features.squeeze().detach().cpu().numpy()
-        data_box.append(image_features)
-    with open("/opt/ml/data/image_feature_vector.pkl", 'wb') as f:
-        pickle.dump(data_box, f)
-    img_vector_df['image_embed'] = data_box
-    book_df = pd.merge(book_df, img_vector_df, on = 'img_path', how = 'left')
-    return book_df
+            image_features = model.encode_image(image_input.to(device))
+        yield image_features.float().cpu().numpy()
 
 
 def text_preprocessing(summary):
@@ -38,32 +137,21 @@ def text_preprocessing(summary):
     return summary
 
 
-def summary_merge(df, user_id, max_summary):
-    temp = " ".join(df[df['user_id'] == user_id].sort_values(by='summary_length', ascending=False)['summary'].values[:max_summary])
-    return temp
+def summary_merge(df, max_summary):
+    # user 별로 summary_length 가 긴 summary 를 max_summary 개까지 이어붙인 문장
+    # 정렬 한 번 + groupby head 로 모든 user 를 한 번에 만듭니다. return: user_id -> 문장 (df 에 처음 나온 user 순서)
+    top = df.sort_values(by='summary_length', ascending=False, kind='mergesort').groupby('user_id', sort=False).head(max_summary)
+    return top.groupby('user_id', sort=False)['summary'].agg(" ".join).reindex(df['user_id'].unique())
 
 
-def text_to_vector(text, model, device):
-    try:
-        text = clip.tokenize(text).to(device)
-        # print(text.shape)
-        with torch.no_grad():
-            text_features = model.encode_text(text)
-            # print(text_features.shape)
-        return text_features.squeeze().detach().cpu().numpy()
-    
-    except:
-        return NONE_TENSOR
-    
-    
-            
-def main(mode):
+def main(mode, model, preprocess, args):
     root_dir = "/opt/ml/data/books"
-    device = "cuda:0"
-    print("[LOAD CLIP]")
-    model, preprocess = clip.load("ViT-B/32", device = device)
+    text_cache = EmbeddingCache(CACHE_DIR, CLIP_MODEL.replace('/', '') + '_text')
+    image_cache = EmbeddingCache(CACHE_DIR, CLIP_MODEL.replace('/', '') + '_image')
+    encode_text = lambda texts: text_batches(texts, model, args.DEVICE, args.BATCH_SIZE)
+    encode_image = lambda paths: image_batches(paths, model, preprocess, args.DEVICE, args.BATCH_SIZE, args.NUM_WORKERS)
 
-    book_df = pd.read_csv(os.path.join(root_dir, 'b01.csv'))
+    book_df = read_variant(root_dir, 'books_base', 'b01')
     rating_df = pd.read_csv(os.path.join("/opt/ml/data/ratings", f'{mode}_ratings.csv'))
     book_df['summary'] = book_df['summary'].apply(lambda x:text_preprocessing(x))
     book_df['book_title'] = book_df['book_title'].apply(lambda x: text_preprocessing(x))
@@ -73,64 +161,42 @@ def main(mode):
     df_fe['summary_length'] = df_fe['summary'].apply(lambda x: len(x))
     print(df_fe.sample(5).columns)
 
+    # 평점에 등장하는 user / isbn 별로 한 행씩, float32 행렬 + id 배열로 저장 (text_data 에서 mmap 으로 읽음)
+    save_dir = f"/opt/ml/data/embedding/{mode}"
+    item_df = book_df[book_df['isbn'].isin(df_fe['isbn'])].drop_duplicates('isbn')
+
     print(f"[USER SUMMARY MERGE VECTOR]")
-    ppath = f"/opt/ml/data/{mode}_user_summary_merge_vector.pkl"
-    if os.path.exists(ppath):
-        with open(ppath, 'rb') as f:
-            user_summary_merge_vector = pickle.load(f)
-        # user_review_text_df = pd.DataFrame(df_fe['user_id'].unique(), columns=['user_id'])
-    else:
-        user_summary_merge_vector = []
-        for x in tqdm(df_fe['user_id'].unique()):
-            user_summary_merge_vector.append(text_to_vector(summary_merge(df_fe, x, 1), model, device))
-        # user_review_text_df = pd.DataFrame(df_fe['user_id'].unique(), columns=['user_id'])
-
-        with open(ppath, 'wb') as f:
-            pickle.dump(user_summary_merge_vector, f)
-    user_review_text_df = pd.DataFrame(df_fe['user_id'].unique(), columns=['user_id'])
-    # print(type(user_review_text_df), user_review_text_df.columns)
+    user_text = summary_merge(df_fe, 1)
+    user_ids, user_text = user_text.index.values, user_text.tolist()
+    vectors = encode_cached([text_hash(x) for x in user_text], user_text, encode_text, text_cache)
+    write_embedding(save_dir, 'user_summary_merge_vector', user_ids, vectors)
 
     print(f"[BOOK TITLE VECTOR]")
-    ppath = f"/opt/ml/data/{mode}_book_title_vector.pkl"
-    if os.path.exists(ppath):
-        with open(ppath, 'rb') as f:
-            book_title_vector = pickle.load(f)
-    else:
-        book_title_vector = []
-        for x in tqdm(book_df['book_title'].tolist()):
-            book_title_vector.append(text_to_vector(x, model, device))
-        with open(ppath, 'wb') as f:
-            pickle.dump(book_title_vector, f)
-
+    titles = item_df['book_title'].tolist()
+    vectors = encode_cached([text_hash(x) for x in titles], titles, encode_text, text_cache)
+    write_embedding(save_dir, 'book_title_vector', item_df['isbn'].values, vectors)
 
     print("[BOOK SUMMARY VECTOR]")
-    ppath = f"/opt/ml/data/{mode}_item_summary_vector.pkl"
-    if os.path.exists(ppath):
-        with open(ppath, 'rb') as f:
-            item_summary_vector = pickle.load(f)
-    else:
-        item_summary_vector = []
-        for x in tqdm(book_df['summary'].tolist()):
-            item_summary_vector.append(text_to_vector(x, model, device))
-        with open(ppath, 'wb') as f:
-            pickle.dump(item_summary_vector, f)
-
-    # print(user_review_text_df.shape, user_review_text_df.columns)
-    user_review_text_df['user_summary_merge_vector'] = user_summary_merge_vector
-    book_df['book_title_vector'] = book_title_vector
-    book_df['item_summary_vector'] = item_summary_vector
-
-
-    df_fe_join = pd.merge(df_fe, user_review_text_df, on='user_id', how='left')
-    df_fe_join = pd.merge(df_fe_join, book_df[['isbn', 'img_path', 'book_title_vector', 'item_summary_vector']], on='isbn', how='left')
-    print(df_fe_join.sample(5).columns)
+    summaries = item_df['summary'].tolist()
+    vectors = encode_cached([text_hash(x) for x in summaries], summaries, encode_text, text_cache)
+    write_embedding(save_dir, 'item_summary_vector', item_df['isbn'].values, vectors)
 
     print("[BOOK IMAGE VECTOR]")
-    book_df = embed_image(df_fe_join, model, preprocess, device)
-    book_df.to_csv(f'/opt/ml/data/{mode}_embedding.csv', index=False)
+    paths = [os.path.join("/opt/ml/input/code/data", name) for name in item_df['img_path']]
+    vectors = encode_cached([file_hash(x) for x in tqdm(paths)], paths, encode_image, image_cache)
+    write_embedding(save_dir, 'image_embed', item_df['isbn'].values, vectors)
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='CLIP embedding')
+    arg = parser.add_argument
+    arg('--DEVICE', type=str, default='cuda:0' if torch.cuda.is_available() else 'cpu', help='encode 할 device 를 설정할 수 있습니다.')
+    arg('--BATCH_SIZE', type=int, default=256, help='한 번에 encode 할 문장 / 이미지 수를 설정할 수 있습니다.')
+    arg('--NUM_WORKERS', type=int, default=4, help='이미지 decode / preprocess worker 수를 설정할 수 있습니다.')
+    args = parser.parse_args()
+
+    print("[LOAD CLIP]")
+    model, preprocess = clip.load(CLIP_MODEL, device = args.DEVICE)
+    model.eval()
     for mode in ['train', 'test']:
-        main(mode)
-    # main('test')
\ No newline at end of file
+        main(mode, model, preprocess, args)
\ No newline at end of file
@@ -0,0 +1,22 @@
+import os
+from pathlib import Path
+
+import numpy as np
+
+
+def write_embedding(save_dir: str, name: str, ids, vectors):
+    """
+    {save_dir}/{name}.npy      : (N, dim) float32 행렬 (np.load(mmap_mode='r') 로 그대로 읽힘)
+    {save_dir}/{name}.ids.npy  : N 개의 user_id / isbn (행 순서), pickle 없이 읽히도록 숫자 / 고정폭 문자열
+    """
+    ids = np.asarray(ids)
+    if ids.dtype == object:
+        ids = ids.astype(str)
+    vectors = np.ascontiguousarray(np.stack(vectors) if isinstance(vectors, list) else vectors, dtype=np.float32)
+    assert len(ids) == len(vectors), f'{name}: ids {len(ids)} != vectors {len(vectors)}'
+
+    ppath = Path(os.path.join(save_dir, f'{name}.npy'))
+    ppath.parent.mkdir(parents=True, exist_ok=True)
+    np.save(str(ppath), vectors)
+    np.save(os.path.join(save_dir, f'{name}.ids.npy'), ids)
+    print(f'[EMBEDDING] {name}: {vectors.shape} -> {ppath}')
@@ -2,43 +2,22 @@ import os
 import pandas as pd
 import numpy as np
 from tqdm import tqdm
-from pathlib import Path
+
+from embedding_store import write_embedding
+
+# clip_embedding.py 는 embedding store (float32 행렬 + id 배열) 를 바로 저장합니다.
+# 이 스크립트는 예전 clip_embedding.py 가 만든 {mode}_embedding.csv 를 같은 store 형식으로 바꿀 때만 씁니다.
 
 def text_process(vector):
-    while '\n' in vector:
-        vector = vector.replace('\n', '')
-    while '[' in vector:
-        vector = vector.replace('[', '')
-    while ']' in vector:
-        vector = vector.replace(']', '')
-    result = np.array(list(map(float, vector.split())))
-    return result
-    
+    # '[ 0.1 -0.2\n 0.3 ...]' 형태의 문자열 -> float 배열
+    return np.array(vector.strip().strip('[]').split(), dtype=np.float32)
+
 
 def process2npy(save_dir, mode, df, case, column_name):
     print(f"[MODE: {mode}, COLUMN_NAME: {column_name}]")
-    new_df = df[[case, column_name]].copy()
-    if case == 'user_id':
-        new_df= new_df.drop_duplicates(case).reset_index(drop=True)
-    else:
-        new_df= new_df.drop_duplicates().reset_index(drop=True)
-    process_list = new_df[column_name].tolist()
-    result_list = []
-    for item in tqdm(process_list):
-        result_list.append(text_process(item))
-    
-    new_df[f"new_{column_name}"] = result_list
-    # result_df = pd.merge(new_df, df, on = case, how = 'left')
-    result_df = new_df.copy()
-
-    vector = np.concatenate([
-                        result_df[case].values.reshape(1, -1),
-                        result_df[f"new_{column_name}"].values.reshape(1, -1)
-    ])
-    ppath = Path(os.path.join(save_dir, f"{column_name}.npy"))
-    ppath.parent.mkdir(parents=True, exist_ok=True)
-    np.save(str(ppath), vector)
-    
+    new_df = df[[case, column_name]].drop_duplicates(case).reset_index(drop=True)
+    vectors = [text_process(item) for item in tqdm(new_df[column_name].tolist())]
+    write_embedding(save_dir, column_name, new_df[case].values, vectors)
 
 
 def main(mode):
@@ -56,4 +35,4 @@ def main(mode):
 
 if __name__ == '__main__':
     for mode in ['train', 'test']:
-        main(mode)
\ No newline at end of file
+        main(mode)
@@ -1,64 +1,32 @@
 import pandas as pd
 import numpy as np
-from tqdm import tqdm
 
 import os
-import pickle
+
+from variants import write_variants
 
 def age1(users: pd.DataFrame, ratings, test_ratings):
+    # 나이가 없는 유저는 (train 에서) 읽은 책들의 '예상 나이' 중앙값으로 채움
+    # 책의 예상 나이 = 그 책을 읽은, 나이가 있는 유저들의 나이 중앙값
     no_age_users = users[users['age'].isna()]['user_id'].unique()
     rating_users = pd.concat([ratings, test_ratings])['user_id'].unique()
 
     no_age_yes_rating = list(set(no_age_users) & set(rating_users))
 
-    def get_age(
-        book_list: list, # 북 리스트는 어떤 유저가 읽은 책 리스트
-        ratings: pd.DataFrame,
-        users: pd.DataFrame,
-        isbn_age: dict
-    ):
-
-        expected_ages = []
-        
-        for isbn in book_list:
-            if isbn in isbn_age:
-                expected_ages.append(isbn_age[isbn])
-                continue
-            yes_read = ratings[ratings['isbn'] == isbn]['user_id'].unique() 
-            yes_age = users[users['age'].notnull()] 
-            expected_age = yes_age[yes_age['user_id'].isin(yes_read)]['age'].median() 
-            isbn_age[isbn] = expected_age 
-            expected_ages.append(expected_age)
-
-        expected_ages = [e for e in expected_ages if not np.isnan(e)] 
-
-        if not expected_ages: 
-            return np.nan
-        return np.round(np.median(expected_ages))
-
-    isbn_age = {}
-    try:
-        f = open('isbn_age.pkl', 'rb')
-        isbn_age = pickle.load(f)
-        f.close()
-    except:
-        pass
-    
-    user_age = {}
-    for user_id in tqdm(no_age_yes_rating):
-        books = ratings[ratings['user_id']==user_id]['isbn'].values
-        user_age[user_id] = get_age(books, ratings, users, isbn_age)
-
-    # if 체크 안해주면 누가 실행하다 중간에 끌 때 dict가 온전치 않게 됨 
-    if not os.path.exists('isbn_age.pkl'):
-        f = open('isbn_age.pkl', 'wb')
-        pickle.dump(isbn_age, f)
-        f.close()
+    # isbn 별 예상 나이 (같은 책을 여러 번 평가한 유저도 한 번만 셈)
+    known_age = users.loc[users['age'].notnull(), ['user_id', 'age']]
+    readers = ratings[['user_id', 'isbn']].drop_duplicates()
+    isbn_age = readers.merge(known_age, on='user_id', how='inner').groupby('isbn')['age'].median()
+
+    # 유저별 예상 나이 (읽은 책 목록 그대로, 예상 나이가 없는 책은 제외)
+    user_books = ratings.loc[ratings['user_id'].isin(no_age_yes_rating), ['user_id', 'isbn']].copy()
+    user_books['age'] = user_books['isbn'].map(isbn_age)
+    user_age = np.round(user_books.dropna(subset=['age']).groupby('user_id')['age'].median())
 
     # age 복사 후 새 컬럼에 복제하고, 결측채움
     users['age1'] = users['age'].copy()
-    for uid, age in user_age.items():
-        users.loc[users['user_id'] == uid, 'age1'] = age
+    fill = users['user_id'].isin(no_age_yes_rating)
+    users.loc[fill, 'age1'] = users.loc[fill, 'user_id'].map(user_age)
 
     # 나머지는 age의 평균값으로 채움
     users.loc[users['age1'].isna(), 'age1'] = np.round(users['age'].mean())
@@ -76,11 +44,8 @@ def age2(users: pd.DataFrame) -> pd.DataFrame:
 
 def age3(users: pd.DataFrame) -> pd.DataFrame:
     # 국가별 평균
-    users['age3'] = users['age'].copy()
-    countries = users['location_country'].value_counts().index
-    for country in countries:
-        mean_age = users[users['location_country'] == country]['age'].mean()
-        users.loc[(users['age'].isna()) & (users['location_country'] == country), 'age3'] = np.round(mean_age)
+    country_age = np.round(users.groupby('location_country')['age'].transform('mean'))
+    users['age3'] = users['age'].fillna(country_age)
 
     users.loc[users['age3'].isna(), 'age3'] = np.round(users['age'].mean())
     print('age3 done')
@@ -124,27 +89,27 @@ def main():
     test_ratings = pd.read_csv('/opt/ml/input/code/data/test_ratings.csv')
 
     # users location을 city, state, country로 나누는 기본 작업
-    users['location'] = users['location'].str.replace(r'[^0-9a-zA-Z:,]', '') # 특수문자 제거
-    users['location_city'] = users['location'].apply(lambda x: x.split(',')[0].strip())
-    users['location_state'] = users['location'].apply(lambda x: x.split(',')[1].strip())
-    users['location_country'] = users['location'].apply(lambda x: x.split(',')[2].strip())
+    users['location'] = users['location'].str.replace(r'[^0-9a-zA-Z:,]', '', regex=True) # 특수문자 제거
+    location = users['location'].str.split(',', expand=True)
+    users['location_city'] = location[0].str.strip()
+    users['location_state'] = location[1].str.strip()
+    users['location_country'] = location[2].str.strip()
 
     users = users.replace('na', 'None')
     users = users.replace('', 'None')
 
-    modify_location = users[(users['location_country'].isna())&(users['location_city'].notnull())]['location_city'].values
+    # country 가 없는 city 는 country 가 있는 같은 city 의 가장 흔한 location 으로 state, country 를 채움
+    modify_location = users[(users['location_country'].isna())&(users['location_city'].notnull())]['location_city'].unique()
+
+    right_location = users[users['location_country'].notnull()].groupby(['location_city', 'location']).size()
+    right_location = right_location.reset_index(name='count').sort_values('count', ascending=False, kind='mergesort')
+    right_location = right_location.drop_duplicates('location_city').set_index('location_city')['location']
+    right_location = right_location[right_location.index.isin(modify_location)].str.split(',', expand=True)
 
-    location_list = []
-    for location in modify_location:
-        try:
-            right_location = users[(users['location'].str.contains(location))&(users['location_country'].notnull())]['location'].value_counts().index[0]
-            location_list.append(right_location)
-        except:
-            pass
-    
-    for location in location_list:
-        users.loc[users[users['location_city']==location.split(',')[0]].index,'location_state'] = location.split(',')[1]
-        users.loc[users[users['location_city']==location.split(',')[0]].index,'location_country'] = location.split(',')[2]
+    if len(right_location):
+        fix = users['location_city'].isin(right_location.index)
+        users.loc[fix, 'location_state'] = users.loc[fix, 'location_city'].map(right_location[1])
+        users.loc[fix, 'location_country'] = users.loc[fix, 'location_city'].map(right_location[2])
 
     # 경우의 수 시작
     users = loc1(users) # eda 처리만, 그대로 복사해서 행 추가
@@ -164,14 +129,20 @@ def main():
         os.makedirs('../../data/users')
 
 
+    # u01 ~ u09: 경우의 수 별 컬럼 선택만 spec 으로 저장 (src/data/store.py 의 load_variant 가 메모리에서 고름)
+    variants = {}
     num = 1
     for i in range(n_loc):
         for j in range(n_age):
             formatted_num = format(num, '02')
-            file = users[['user_id', f'location_city{i+1}', f'location_state{i+1}', f'location_country{i+1}', f'age{j+1}']]
-            file.columns = [['user_id', 'location_city', 'location_state', 'location_country', 'age']]
-            file.to_csv(f'../../data/users/u{formatted_num}.csv', index=False)
+            variants[f'u{formatted_num}'] = {
+                'location_city': f'location_city{i+1}',
+                'location_state': f'location_state{i+1}',
+                'location_country': f'location_country{i+1}',
+                'age': f'age{j+1}',
+            }
             num += 1
+    write_variants(users, 'user_id', variants, '../../data/users', 'users_base')
 
 
 if __name__ == '__main__':
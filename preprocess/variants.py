@@ -0,0 +1,53 @@
+import os
+import json
+
+import numpy as np
+import pandas as pd
+
+
+def write_variants(df: pd.DataFrame, id_column: str, variants: dict, save_dir: str, base_name: str):
+    """
+    경우의 수 마다 csv 를 만들지 않고, 후보 컬럼을 모두 담은 base 테이블 하나와 variant spec 을 저장합니다.
+    variants: {'u01': {'location_city': 'location_city1', ...}, ...}
+    모든 값이 -1 인 컬럼은 spec 에 None 으로, 내용이 같은 컬럼은 base 에 한 번만 저장합니다.
+    """
+    sources = {id_column: id_column}  # df 컬럼 -> base 컬럼 (None 은 -1)
+    spec = {}
+    for name, columns in variants.items():
+        spec[name] = {id_column: id_column}
+        for column, source in columns.items():
+            if source not in sources:
+                if (df[source] == -1).all():
+                    sources[source] = None
+                else:
+                    sources[source] = next((base for prev, base in sources.items()
+                                            if base is not None and df[prev].equals(df[source])), source)
+            spec[name][column] = sources[source]
+
+    base_columns = list(dict.fromkeys(base for base in sources.values() if base is not None))
+    df[base_columns].to_csv(os.path.join(save_dir, f'{base_name}.csv'), index=False)
+    with open(os.path.join(save_dir, 'variants.json'), 'w') as f:
+        json.dump(spec, f, indent=4)
+
+
+def read_variant(save_dir: str, base_name: str, name: str) -> pd.DataFrame:
+    """
+    write_variants 로 저장한 base 테이블에서 한 경우의 수(ex. b01)를 골라 읽습니다.
+    spec 이 없으면 기존처럼 {name}.csv 를 읽습니다.
+    """
+    spec_path = os.path.join(save_dir, 'variants.json')
+    if not os.path.exists(spec_path):
+        return pd.read_csv(os.path.join(save_dir, f'{name}.csv'))
+    with open(spec_path) as f:
+        spec = json.load(f)[name]
+    base = pd.read_csv(os.path.join(save_dir, f'{base_name}.csv'), usecols=[s for s in spec.values() if s is not None])
+    return select_variant(base, spec)
+
+
+def select_variant(base: pd.DataFrame, columns: dict) -> pd.DataFrame:
+    """
+    spec 의 {출력 컬럼: base 컬럼} 대로 base 테이블에서 컬럼을 고릅니다. base 컬럼이 None 이면 -1.
+    read_variant 와 src.data.store.load_variant 가 같이 씁니다.
+    """
+    return pd.DataFrame({column: base[source] if source is not None else np.full(len(base), -1, dtype=np.int64)
+                         for column, source in columns.items()})
@@ -0,0 +1,72 @@
+import numpy as np
+import torch
+
+
+class FastTensorLoader:
+    """
+    TensorDataset + DataLoader 대신, 메모리에 올라간 tensor 들에서 batch 를 index 한 번으로 잘라 주는 loader.
+    sample 단위 collate 와 worker 없이 main process 에서 바로 batch 를 만듭니다.
+    DataLoader 와 같은 순서로 난수를 뽑아 randperm 하므로, 같은 seed 에서 DataLoader 와 같은 batch 가 나옵니다.
+    sampler: batch 단위 index 를 내는 sampler (ex. WeightedBatchSampler), 주면 shuffle 대신 사용
+    """
+    def __init__(self, *tensors, batch_size=1, shuffle=False, drop_last=False, sampler=None):
+        assert all(len(tensor) == len(tensors[0]) for tensor in tensors), 'tensor 들의 길이가 다릅니다.'
+        self.tensors = tensors
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.sampler = sampler
+
+    def __len__(self):
+        if self.sampler is not None:
+            return len(self.sampler)
+        n = len(self.tensors[0])
+        if self.drop_last:
+            return n // self.batch_size
+        return (n + self.batch_size - 1) // self.batch_size
+
+    def indices(self):
+        n = len(self.tensors[0])
+        # DataLoader iterator 의 base seed (worker seed 용) 와 같은 난수 하나 소비
+        torch.empty((), dtype=torch.int64).random_()
+        if not self.shuffle or self.sampler is not None:
+            return None
+        # RandomSampler 와 같이 전역 RNG 에서 seed 를 뽑아 randperm
+        generator = torch.Generator()
+        generator.manual_seed(int(torch.empty((), dtype=torch.int64).random_().item()))
+        return torch.randperm(n, generator=generator)
+
+    def __iter__(self):
+        index = self.indices()
+        if self.sampler is not None:
+            for batch in self.sampler:
+                yield [tensor[batch] for tensor in self.tensors]
+            return
+        for start in range(0, len(self) * self.batch_size, self.batch_size):
+            if index is None:
+                yield [tensor[start:start + self.batch_size] for tensor in self.tensors]
+            else:
+                batch = index[start:start + self.batch_size]
+                yield [tensor[batch] for tensor in self.tensors]
+
+
+class WeightedBatchSampler:
+    """
+    평점(label) 별 빈도의 역수로 가중치를 주어 복원 추출하는 batch sampler.
+    한 epoch 의 index 를 torch.multinomial 한 번으로 뽑아 batch_size 씩 잘라 줍니다.
+    (WeightedRandomSampler + batch_size 로 묶은 것과 같은 순서)
+    FastTensorLoader(sampler=...) 와 DataLoader(batch_sampler=...) 에 모두 쓸 수 있습니다.
+    """
+    def __init__(self, labels, batch_size, num_samples=None):
+        _, inverse, count = np.unique(np.asarray(labels), return_inverse=True, return_counts=True)
+        class_weights = len(inverse) / count
+        self.weights = torch.as_tensor(class_weights[inverse.reshape(-1)], dtype=torch.double)
+        self.batch_size = batch_size
+        self.num_samples = len(inverse) if num_samples is None else num_samples
+
+    def __len__(self):
+        return (self.num_samples + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        index = torch.multinomial(self.weights, self.num_samples, replacement=True)
+        yield from index.split(self.batch_size)
@@ -0,0 +1,35 @@
+import numpy as np
+
+
+AGE_EDGES = [20, 30, 40, 50, 60]
+
+# year_of_publication 분포
+# 25%        1991.000000
+# 50%        1996.000000
+# 75%        2000.000000
+# max        2006.000000
+YEAR_OF_PUBLICATION_EDGES = [1991, 1996, 2000]
+
+
+def bucketize(values, edges) -> np.ndarray:
+    """
+    edges 기준으로 구간을 나눠 1 부터 시작하는 bucket 번호를 돌려줍니다.
+    edges = [20, 30] 이면 x < 20 -> 1, 20 <= x < 30 -> 2, 30 <= x -> 3
+    """
+    return np.digitize(np.asarray(values, dtype=np.float64), edges).astype(np.int64) + 1
+
+
+def age_bucket(values) -> np.ndarray:
+    return bucketize(values, AGE_EDGES)
+
+
+def year_of_publication_bucket(values) -> np.ndarray:
+    return bucketize(values, YEAR_OF_PUBLICATION_EDGES)
+
+
+def age_map(x: int) -> int:
+    return int(age_bucket([int(x)])[0])
+
+
+def year_of_publication_map(x: int) -> int:
+    return int(year_of_publication_bucket([int(x)])[0])
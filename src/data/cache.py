@@ -0,0 +1,151 @@
+import os
+import json
+import pickle
+import shutil
+import hashlib
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from src.data.store import STORE_DIR, feather, input_names, store_path
+
+
+CACHE_DIR = 'cache'
+HASH_MEMO = 'hashes.json'
+MANIFEST = 'manifest.json'
+# *_data_load 가 만드는 결과의 형식이 바뀌면 올려서 예전 캐시를 쓰지 않게 합니다.
+CACHE_VERSION = 6
+
+
+def file_hash(ppath: Path, memo: dict) -> str:
+    """
+    파일 내용의 sha1. (경로, 크기, 수정 시각) 이 같으면 memo 의 값을 다시 씁니다.
+    """
+    stat = ppath.stat()
+    stamp = [stat.st_size, stat.st_mtime_ns]
+    entry = memo.get(str(ppath))
+    if entry is not None and entry['stamp'] == stamp:
+        return entry['sha1']
+    sha1 = hashlib.sha1()
+    with open(ppath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(chunk)
+    memo[str(ppath)] = {'stamp': stamp, 'sha1': sha1.hexdigest()}
+    return memo[str(ppath)]['sha1']
+
+
+def input_hashes(args) -> dict:
+    """
+    USER_NUM / BOOK_NUM 에 쓰이는 입력 파일(csv, 없으면 store) 마다 내용 sha1.
+    """
+    memo_path = Path(args.DATA_PATH, STORE_DIR, CACHE_DIR, HASH_MEMO)
+    memo = {}
+    if memo_path.exists():
+        try:
+            with open(memo_path) as f:
+                memo = json.load(f)
+        except ValueError:
+            memo = {}
+
+    hashes = {}
+    for name in input_names(args):
+        ppath = Path(args.DATA_PATH, name)
+        if not ppath.exists():
+            ppath = store_path(args.DATA_PATH, name)
+        hashes[name] = file_hash(ppath, memo)
+
+    memo_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = Path(f'{memo_path}.{os.getpid()}')
+    with open(tmp_path, 'w') as f:
+        json.dump(memo, f)
+    os.replace(str(tmp_path), str(memo_path))
+    return hashes
+
+
+def cache_key(args, family: str) -> dict:
+    key = {'version': CACHE_VERSION, 'family': family,
+           'USER_NUM': args.USER_NUM, 'BOOK_NUM': args.BOOK_NUM, 'inputs': input_hashes(args)}
+    key['sha1'] = hashlib.sha1(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+    return key
+
+
+def cache_prefix(args, family: str) -> str:
+    return f'{family}_u{args.USER_NUM:02d}_b{args.BOOK_NUM:02d}'
+
+
+def cache_path(args, key: dict) -> Path:
+    return Path(args.DATA_PATH, STORE_DIR, CACHE_DIR, f"{cache_prefix(args, key['family'])}_{key['sha1'][:16]}")
+
+
+def load_cached(args, family: str):
+    """
+    같은 family / 경우의 수 / 입력 파일 내용으로 저장해둔 *_data_load 결과가 있으면 읽고, 없으면 None.
+    입력 파일이 하나라도 바뀌면 key(sha1) 가 달라져서 자동으로 새로 만듭니다.
+    """
+    if feather is None:
+        return None
+    key = cache_key(args, family)
+    ppath = cache_path(args, key)
+    if not Path(ppath, MANIFEST).exists():
+        return None
+
+    with open(Path(ppath, MANIFEST)) as f:
+        manifest = json.load(f)
+    data = {}
+    for name in manifest['frames']:
+        data[name] = feather.read_table(str(Path(ppath, f'{name}.feather')), memory_map=True, use_threads=True).to_pandas(use_threads=True)
+    with np.load(str(Path(ppath, 'arrays.npz'))) as arrays:
+        data.update({name: arrays[name] for name in manifest['arrays']})
+    with open(Path(ppath, 'objects.pkl'), 'rb') as f:
+        data.update(pickle.load(f))
+    print(f'[CACHE] {cache_prefix(args, family)} <- {ppath}')
+    return data
+
+
+def save_cached(args, family: str, data: dict, skip=()):
+    """
+    data 의 DataFrame 은 feather, ndarray 는 npz, 나머지(encoder, ContextTable, 컬럼 목록 ...)는 pickle 로
+    {DATA_PATH}/store/cache/{family}_uXX_bXX_{sha1}/ 에 저장하고 manifest.json 에 목록과 key 를 적습니다.
+    skip: 저장하지 않고 불러올 때 다시 만드는 key (ex. memory map 으로 여는 text embedding)
+    """
+    if feather is None:
+        return
+    key = cache_key(args, family)
+    ppath = cache_path(args, key)
+    # 같은 key 를 동시에 저장하는 process 끼리 겹치지 않게 pid 별 임시 디렉토리에 씀
+    tmp_path = Path(f'{ppath}.{os.getpid()}.tmp')
+    shutil.rmtree(str(tmp_path), ignore_errors=True)
+    tmp_path.mkdir(parents=True)
+
+    frames, arrays, objects = [], {}, {}
+    for name, value in data.items():
+        if name in skip:
+            continue
+        if isinstance(value, pd.DataFrame):
+            feather.write_feather(value, str(tmp_path / f'{name}.feather'), compression='uncompressed')
+            frames.append(name)
+        elif isinstance(value, np.ndarray):
+            arrays[name] = value
+        else:
+            objects[name] = value
+    np.savez(str(tmp_path / 'arrays.npz'), **arrays)
+    with open(tmp_path / 'objects.pkl', 'wb') as f:
+        pickle.dump(objects, f)
+    with open(tmp_path / MANIFEST, 'w') as f:
+        json.dump({'key': key, 'frames': frames, 'arrays': list(arrays), 'objects': list(objects)}, f, indent=4)
+
+    # 다른 process 가 먼저 같은 key 를 저장했으면 그것을 그대로 두고 내 것은 버림
+    if not ppath.exists():
+        try:
+            os.rename(str(tmp_path), str(ppath))
+        except OSError:
+            # exists 와 rename 사이에 다른 process 가 먼저 옮긴 경우 (ENOTEMPTY)
+            pass
+    shutil.rmtree(str(tmp_path), ignore_errors=True)
+
+    # 입력이 바뀌기 전에 만든 같은 경우의 수의 캐시(key 가 다른 것)만 지움. 저장 중인 임시 디렉토리는 건드리지 않음
+    for old_path in ppath.parent.glob(cache_prefix(args, family) + '_*'):
+        if old_path != ppath and old_path.suffix != '.tmp':
+            shutil.rmtree(str(old_path), ignore_errors=True)
+    print(f'[CACHE] {cache_prefix(args, family)} -> {ppath}')
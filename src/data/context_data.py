@@ -4,167 +4,250 @@ from sklearn.model_selection import train_test_split
 import torch
 import torch.nn as nn
 from torch.utils.data import TensorDataset, DataLoader, Dataset
+from src.data.store import load_inputs
+from src.data.batch import FastTensorLoader, WeightedBatchSampler
+from src.data.folds import FoldView
+from src.data.schema import RATING_MAX, apply_schema, code_dtype, code_tensor, target_tensor, torch_dtype
+from src.data.server import attach_context
+from src.data.cache import load_cached, save_cached
+from src.data.lazy import LazyData
+from src.data.encoder import USER_FIELDS, BOOK_FIELDS, load_encoder
+from src.data.bucket import AGE_EDGES, YEAR_OF_PUBLICATION_EDGES, age_bucket, year_of_publication_bucket
 
-def age_map(x: int) -> int:
-    x = int(x)
-    if x < 20:
-        return 1
-    elif x >= 20 and x < 30:
-        return 2
-    elif x >= 30 and x < 40:
-        return 3
-    elif x >= 40 and x < 50:
-        return 4
-    elif x >= 50 and x < 60:
-        return 5
-    else:
-        return 6
-
-def year_of_publication_map(x: int) -> int:
-    """
-    25%        1991.000000
-    50%        1996.000000
-    75%        2000.000000
-    max        2006.000000
-    """
-    x = int(x)
-    if x < 1991:
-        return 1
-    elif x >= 1991 and x < 1996:
-        return 2
-    elif x >= 1996 and x < 2000:
-        return 3
-    else:
-        return 4
-
-def process_context_data(users, books, ratings1, ratings2):
-    ratings = pd.concat([ratings1, ratings2]).reset_index(drop=True)
-
-    # 인덱싱 처리된 데이터 조인
-    context_df = ratings.merge(users, on='user_id', how='left').merge(books[['isbn', 'category', 'publisher', 'year_of_publication', 'book_author']], on='isbn', how='left')
-    train_df = ratings1.merge(users, on='user_id', how='left').merge(books[['isbn', 'category', 'publisher', 'year_of_publication', 'book_author']], on='isbn', how='left')
-    test_df = ratings2.merge(users, on='user_id', how='left').merge(books[['isbn', 'category', 'publisher', 'year_of_publication', 'book_author']], on='isbn', how='left')
-
-    column_list = ['location_city', 'location_state', 'location_country', 'age', 'book_author', \
-                        'year_of_publication', 'publisher', 'category']
-
-    # -1 컬럼 제외 처리
-    columns = [column for column in column_list if train_df.iloc[0][column] != -1]
-
-    # 인덱싱 처리
-    loc_city2idx = {v:k for k,v in enumerate(context_df['location_city'].unique())}
-    loc_state2idx = {v:k for k,v in enumerate(context_df['location_state'].unique())}
-    loc_country2idx = {v:k for k,v in enumerate(context_df['location_country'].unique())}
-
-    train_df['location_city'] = train_df['location_city'].map(loc_city2idx)
-    train_df['location_state'] = train_df['location_state'].map(loc_state2idx)
-    train_df['location_country'] = train_df['location_country'].map(loc_country2idx)
-    test_df['location_city'] = test_df['location_city'].map(loc_city2idx)
-    test_df['location_state'] = test_df['location_state'].map(loc_state2idx)
-    test_df['location_country'] = test_df['location_country'].map(loc_country2idx)
-
-    train_df['age'] = train_df['age'].apply(age_map)
-    test_df['age'] = test_df['age'].apply(age_map)
-
-    # year of publication cases 4
-    train_df['year_of_publication'] = train_df['year_of_publication'].apply(year_of_publication_map)
-    test_df['year_of_publication'] = test_df['year_of_publication'].apply(year_of_publication_map)
-
-    # book 파트 인덱싱
-    category2idx = {v:k for k,v in enumerate(context_df['category'].unique())}
-    publisher2idx = {v:k for k,v in enumerate(context_df['publisher'].unique())}
-    author2idx = {v:k for k,v in enumerate(context_df['book_author'].unique())}
-
-    train_df['category'] = train_df['category'].map(category2idx)
-    train_df['publisher'] = train_df['publisher'].map(publisher2idx)
-    train_df['book_author'] = train_df['book_author'].map(author2idx)
-    test_df['category'] = test_df['category'].map(category2idx)
-    test_df['publisher'] = test_df['publisher'].map(publisher2idx)
-    test_df['book_author'] = test_df['book_author'].map(author2idx)
-
-    idx = {
-        "loc_city2idx":loc_city2idx,
-        "loc_state2idx":loc_state2idx,
-        "loc_country2idx":loc_country2idx,
-        "category2idx":category2idx,
-        "publisher2idx":publisher2idx,
-        "author2idx":author2idx,
-    }
-
-    length_db = {'age':6, 'year_of_publication': 4, 
-                'location_city': len(idx['loc_city2idx']), 'location_state': len(idx['loc_state2idx']), 
-                'location_country': len(idx['loc_country2idx']), 'category': len(idx['category2idx']), 'publisher': len(idx['publisher2idx']),
-                'book_author': len(idx['author2idx'])}
-    field_dims = [length_db[column] for column in columns]
-
-    return idx, train_df, test_df, columns, field_dims
 
+COLUMN_LIST = ['location_city', 'location_state', 'location_country', 'age', 'book_author', \
+                    'year_of_publication', 'publisher', 'category']
+USER_COLUMNS = ['location_city', 'location_state', 'location_country', 'age']
+BOOK_COLUMNS = ['book_author', 'year_of_publication', 'publisher', 'category']
+GBM_MODELS = ('XGB', 'LGBM', 'CATB')
 
-def context_data_load(args):
 
-    ######################## DATA LOAD
-    formatted_user_num = format(args.USER_NUM, '02')
-    formatted_book_num = format(args.BOOK_NUM, '02')
-    users = pd.read_csv(args.DATA_PATH + 'users/' + f'u{formatted_user_num}.csv')
-    books = pd.read_csv(args.DATA_PATH + 'books/' + f'b{formatted_book_num}.csv')
-    train = pd.read_csv(args.DATA_PATH + 'ratings/' + 'train_ratings.csv')
-    test = pd.read_csv(args.DATA_PATH + 'ratings/' + 'test_ratings.csv')
-    sub = pd.read_csv(args.DATA_PATH + 'ratings/' + 'sample_submission.csv')
+class ContextTable:
+    """
+    인코딩된 user / book 속성을 user_id, isbn 인덱스 위치에 그대로 담아둔 배열들.
+    평점 행마다 merge 하는 대신 필드별 np.take 한 번으로 context 행렬을 만들고,
+    필요한 행(fold, 배치 등)만 골라서 만들 수도 있습니다.
+    """
+    def __init__(self, users, books, encoder):
+        # user_id / isbn 은 이미 인코딩된 상태여야 합니다.
+        user_table = users.drop_duplicates('user_id').set_index('user_id').reindex(np.arange(encoder.size('user_id')))
+        book_table = books.drop_duplicates('isbn').set_index('isbn').reindex(np.arange(encoder.size('isbn')))
+
+        self.field_sizes = {'age': len(AGE_EDGES) + 1, 'year_of_publication': len(YEAR_OF_PUBLICATION_EDGES) + 1}
+        self.field_sizes.update({column: encoder.size(column) for column in ['user_id', 'isbn'] + USER_FIELDS + BOOK_FIELDS})
+
+        # 필드마다 schema 의 가장 작은 정수 dtype 으로 저장
+        self.tables = {}
+        for column in USER_FIELDS:
+            self.tables[column] = encoder.transform(column, user_table[column])
+        for column in BOOK_FIELDS:
+            self.tables[column] = encoder.transform(column, book_table[column])
+        self.tables['age'] = age_bucket(user_table['age'])
+        self.tables['year_of_publication'] = year_of_publication_bucket(book_table['year_of_publication'])
+        for column, table in self.tables.items():
+            self.tables[column] = table.astype(code_dtype(self.field_sizes[column]))
+
+        # -1 컬럼 제외 처리
+        self.columns = [column for column in COLUMN_LIST
+                        if not ((users if column in USER_COLUMNS else books)[column] == -1).all()]
+        # ContextRows 들이 같이 쓰는 batch 용 행렬은 한 번만 만듦
+        self.user_matrix, self.book_matrix = self.build_matrices()
+
+    @classmethod
+    def from_arrays(cls, field_sizes, columns, tables, matrices):
+        """
+        이미 만들어둔 tables / 행렬로 인코딩 없이 만듭니다. (data server 가 올려둔 memory map 등)
+        """
+        context = cls.__new__(cls)
+        context.field_sizes, context.columns, context.tables = dict(field_sizes), list(columns), dict(tables)
+        context.user_matrix, context.book_matrix = (torch.from_numpy(matrix) for matrix in matrices)
+        return context
+
+    def field_dims(self, columns=None) -> list:
+        columns = self.columns if columns is None else columns
+        return [self.field_sizes[column] for column in columns]
+
+    def gather(self, user_idx, isbn_idx, columns=None) -> dict:
+        columns = self.columns if columns is None else columns
+        fields = {'user_id': np.asarray(user_idx), 'isbn': np.asarray(isbn_idx)}
+        for column in columns:
+            index = fields['user_id'] if column in USER_COLUMNS else fields['isbn']
+            fields[column] = np.take(self.tables[column], index)
+        return fields
+
+    def frame(self, ratings, columns=None) -> pd.DataFrame:
+        """
+        ratings 의 user_id, isbn (+ rating) 으로 context frame 을 만듭니다.
+        """
+        fields = self.gather(ratings['user_id'].values, ratings['isbn'].values, columns)
+        if 'rating' in ratings:
+            fields['rating'] = ratings['rating'].values
+        return pd.DataFrame(fields, index=ratings.index)
+
+    def build_matrices(self):
+        """
+        self.columns 중 user / book 컬럼을 user_id, isbn 위치에 모은 행렬 두 개. (각 행렬의 컬럼을 모두 담는 code dtype)
+        """
+        matrices = []
+        for key, columns in (('user_id', USER_COLUMNS), ('isbn', BOOK_COLUMNS)):
+            columns = [column for column in self.columns if column in columns]
+            dtype = code_dtype(max(self.field_dims(columns), default=0))
+            matrix = np.zeros((self.field_sizes[key], len(columns)), dtype=dtype)
+            for position, column in enumerate(columns):
+                matrix[:, position] = self.tables[column]
+            matrices.append(torch.from_numpy(matrix))
+        return tuple(matrices)
+
+    def matrices(self):
+        return self.user_matrix, self.book_matrix
+
+    def rows(self, ratings):
+        """
+        user_id, isbn 만 담은 평점 행들을 batch 마다 context 를 붙여 읽는 ContextRows 로 만듭니다.
+        이미 ContextRows (fold view 등) 면 그대로 돌려줍니다.
+        """
+        if isinstance(ratings, FoldView):
+            return ratings
+        columns = ['user_id', 'isbn'] + self.columns
+        base = code_tensor(ratings[['user_id', 'isbn']].values, max(self.field_dims(['user_id', 'isbn'])))
+        return ContextRows(base, columns, self.matrices(), torch_dtype(code_dtype(max(self.field_dims(columns)))))
+
+
+class ContextRows(FoldView):
+    """
+    (user_id, isbn) 행만 들고, 읽을 때 ContextTable 에서 context 컬럼을 모아
+    [user_id, isbn] + context.columns 순서의 행렬로 펼치는 view. (모든 필드를 담는 가장 작은 code dtype)
+    평점 행마다 context 컬럼을 복사해두지 않으므로 컬럼을 늘려도 학습 행렬 크기는 그대로입니다.
+    tensor 만 들고 있으므로 process pool 로 넘기면 shared memory 로 넘어갑니다.
+    """
+    def __init__(self, base, columns, matrices, dtype, index=None, positions=None):
+        super().__init__(base, columns, index, positions)
+        self.user_matrix, self.book_matrix = matrices
+        self.dtype = dtype
 
-    ids = pd.concat([train['user_id'], sub['user_id']]).unique()
-    isbns = pd.concat([train['isbn'], sub['isbn']]).unique()
+    def view(self, index, positions):
+        return ContextRows(self.base, self.columns, (self.user_matrix, self.book_matrix), self.dtype, index, positions)
 
-    idx2user = {idx:id for idx, id in enumerate(ids)}
-    idx2isbn = {idx:isbn for idx, isbn in enumerate(isbns)}
+    def expand(self, batch):
+        index = batch.long()
+        return torch.cat([batch.to(self.dtype), self.user_matrix[index[:, 0]].to(self.dtype),
+                          self.book_matrix[index[:, 1]].to(self.dtype)], dim=1)
 
-    user2idx = {id:idx for idx, id in idx2user.items()}
-    isbn2idx = {isbn:idx for idx, isbn in idx2isbn.items()}
 
-    train['user_id'] = train['user_id'].map(user2idx)
-    sub['user_id'] = sub['user_id'].map(user2idx)
-    test['user_id'] = test['user_id'].map(user2idx)
-    users['user_id'] = users['user_id'].map(user2idx)
+def context_rows(data, key):
+    """
+    data[key] 가 이미 ContextRows (fold view 등) 면 그대로, 평점 frame 이면 data['context'].rows 로 만듭니다.
+    """
+    if isinstance(data[key], FoldView):
+        return data[key]
+    return data['context'].rows(data[key])
 
-    train['isbn'] = train['isbn'].map(isbn2idx)
-    sub['isbn'] = sub['isbn'].map(isbn2idx)
-    test['isbn'] = test['isbn'].map(isbn2idx)
-    books['isbn'] = books['isbn'].map(isbn2idx)
 
-    idx, context_train, context_test, columns, field_dims = process_context_data(users, books, train, test)
+def ratings_frame(ratings, encoder, rating=True) -> pd.DataFrame:
     """
-    'user_id': len(user2idx), 'isbn': len(isbn2idx), 
+    평점 frame 에서 user_id, isbn (+ rating) 만 schema 의 code dtype 으로 남깁니다.
     """
-    columns = ['user_id', 'isbn'] + columns
-    field_dims = np.array([len(user2idx), len(isbn2idx)] + field_dims, dtype = np.int64)
-    context_train = context_train[columns + ['rating']]
-    context_test = context_test[columns + ['rating']]
+    sizes = {'user_id': encoder.size('user_id'), 'isbn': encoder.size('isbn')}
+    if rating:
+        sizes['rating'] = RATING_MAX
+    return apply_schema(ratings, sizes)
 
-    data = {
-            'train':context_train,
-            'test':context_test.drop(['rating'], axis=1),
+
+def encode_inputs(args):
+    """
+    입력을 읽고 user_id / isbn 을 저장된 encoder 로 인덱싱합니다.
+    """
+    users, books, train, test, sub = load_inputs(args)
+    encoder = load_encoder(args, users, books, train, sub)
+
+    for df in (train, sub, test, users):
+        df['user_id'] = encoder.transform('user_id', df['user_id'])
+    for df in (train, sub, test, books):
+        df['isbn'] = encoder.transform('isbn', df['isbn'])
+
+    return users, books, train, test, sub, encoder
+
+
+def context_inputs(args) -> dict:
+    """
+    context / dl / text 가 같이 쓰는 train / test 코드 (ratings_frame), field_dims, encoder, ContextTable.
+    """
+    users, books, train, test, sub, encoder = encode_inputs(args)
+    context = ContextTable(users, books, encoder)
+
+    field_dims = np.array([encoder.size('user_id'), encoder.size('isbn')] + context.field_dims(), dtype = np.int64)
+
+    return {
+            'train':ratings_frame(train, encoder),
+            'test':ratings_frame(test, encoder, rating=False),
             'field_dims':field_dims,
-            'users':users,
-            'books':books,
-            'sub':sub,
-            'idx2user':idx2user,
-            'idx2isbn':idx2isbn,
-            'user2idx':user2idx,
-            'isbn2idx':isbn2idx,
+            'encoder':encoder,
+            'context':context,
             }
 
+
+def shared_inputs(args):
+    """
+    --DATA_SERVER 가 떠 있으면 서버가 공유 메모리에 올려둔 context_inputs 를 memory map 으로 읽고, 아니면 None.
+    """
+    if not args.DATA_SERVER:
+        return None
+    return attach_context(args)
+
+
+def load_context_inputs(args, family: str) -> dict:
+    """
+    context_inputs 를 data server -> family 캐시 순서로 찾고, 둘 다 없으면 만들어서 캐시합니다.
+    서버에 연결되면 캐시는 읽지도 쓰지도 않습니다.
+    """
+    data = shared_inputs(args)
+    if data is not None:
+        return data
+    data = load_cached(args, family)
+    if data is None:
+        ######################## DATA LOAD
+        data = context_inputs(args)
+        save_cached(args, family, data)
+    return data
+
+
+def context_data_load(args):
+    """
+    train / test 는 (user_id, isbn, rating) 평점 행만 들고, context 컬럼은 data['context'] 에서
+    batch 마다 모읍니다. (context_data_loader 의 ContextRows) GBM 은 펼친 frame 을 씁니다.
+    """
+    data = LazyData(load_context_inputs(args, 'context'))
+    if args.MODEL in GBM_MODELS:
+        data['train'] = data['context'].frame(data['train'])
+        data['test'] = data['context'].frame(data['test'])
     return data
 
 
+def one_hot(df, categories: dict) -> pd.DataFrame:
+    """
+    categories 의 컬럼들을 주어진 값 목록으로 one-hot 합니다. (없는 값도 0 컬럼으로 만들어 train / test 컬럼을 맞춤)
+    """
+    df = df.astype({column: pd.CategoricalDtype(values) for column, values in categories.items()})
+    return pd.get_dummies(df, columns=list(categories))
+
+
+def gbm_test_dataloader(test):
+    return test, None
+
+
 def context_data_split(args, data):
-    if args.MODEL in ('XGB', 'LGBM', 'CATB'):
-        re_concat = pd.concat([data['train'], data['test']]).reset_index(drop=True)
-        re_concat = re_concat.drop(['isbn', 'user_id'], axis=1)
-        re_concat = pd.get_dummies(re_concat, columns=re_concat.drop('rating', axis=1).columns)
-        
-        print(re_concat.columns)
+    if args.MODEL in GBM_MODELS:
+        train = data['train'].drop(['isbn', 'user_id'], axis=1)
+        test = data['test'].drop(['isbn', 'user_id'], axis=1)
+        # one-hot 컬럼은 train + test 에 나오는 값 전체로 정하고, test 의 one-hot 은 처음 쓸 때 만듭니다.
+        categories = {column: np.union1d(train[column].unique(), test[column].unique()) for column in test.columns}
+        train = one_hot(train, categories)
+        train['rating'] = train['rating'].astype(np.float64)
 
-        data['train'] = re_concat[re_concat['rating'].notnull()]
-        data['test'] = re_concat[re_concat['rating'].isna()].drop('rating', axis=1)
+        print(train.columns)
+
+        data['train'] = train
+        data.lazy('test', one_hot, test, categories)
 
 
     X_train, X_valid, y_train, y_valid = train_test_split(
@@ -175,8 +258,9 @@ def context_data_split(args, data):
                                                         shuffle=True
                                                         )
     
-    X_train.columns = [str(i) for i in range(len(X_train.columns))]
-    X_valid.columns = [str(i) for i in range(len(X_valid.columns))]
+    if args.MODEL in GBM_MODELS:
+        X_train.columns = [str(i) for i in range(len(X_train.columns))]
+        X_valid.columns = [str(i) for i in range(len(X_valid.columns))]
     
     data['X_train'], data['X_valid'], data['y_train'], data['y_valid'] = X_train, X_valid, y_train, y_valid
     print(data['X_train'].head(5))
@@ -184,23 +268,21 @@ def context_data_split(args, data):
 
 
 def context_data_loader(args, data):
-    if args.MODEL in ('XGB', 'LGBM', 'CATB'):
-        data['train_dataloader'], data['valid_dataloader'], data['test_dataloader'] = \
-            (data['X_train'], data['y_train']), (data['X_valid'], data['y_valid']), (data['test'], None)
+    if args.MODEL in GBM_MODELS:
+        data['train_dataloader'], data['valid_dataloader'] = (data['X_train'], data['y_train']), (data['X_valid'], data['y_valid'])
+        data.lazy('test_dataloader', gbm_test_dataloader, data.ref('test'))
     
     else:
+        # 작은 정수 행렬이라 worker / sample 단위 collate 없이 batch 단위로 바로 잘라 씁니다.
+        # (user_id, isbn) 행에 context 컬럼은 batch 마다 붙입니다.
+        y_train, y_valid = target_tensor(data['y_train'].values), target_tensor(data['y_valid'].values)
         if args.ZEROONE:
-            train_dataset = TensorDataset(torch.LongTensor(data['X_train'].values), torch.FloatTensor(data['y_train'].values) / 10.0)
-            valid_dataset = TensorDataset(torch.LongTensor(data['X_valid'].values), torch.FloatTensor(data['y_valid'].values) / 10.0)
-        else:
-            train_dataset = TensorDataset(torch.LongTensor(data['X_train'].values), torch.FloatTensor(data['y_train'].values))
-            valid_dataset = TensorDataset(torch.LongTensor(data['X_valid'].values), torch.FloatTensor(data['y_valid'].values))
-    test_dataset = TensorDataset(torch.LongTensor(data['test'].values))
-    
-    train_dataloader = DataLoader(train_dataset, batch_size=args.BATCH_SIZE, shuffle=args.DATA_SHUFFLE, num_workers = 4)
-    valid_dataloader = DataLoader(valid_dataset, batch_size=args.BATCH_SIZE, shuffle=args.DATA_SHUFFLE, num_workers = 4)
-    test_dataloader = DataLoader(test_dataset, batch_size=args.BATCH_SIZE, shuffle=False, num_workers = 4)
+            y_train, y_valid = y_train / 10.0, y_valid / 10.0
+        sampler = WeightedBatchSampler(data['y_train'].values, args.BATCH_SIZE) if args.WEIGHTED_SAMPLER else None
+        train_dataloader = FastTensorLoader(context_rows(data, 'X_train'), y_train, batch_size=args.BATCH_SIZE, shuffle=args.DATA_SHUFFLE, sampler=sampler)
+        valid_dataloader = FastTensorLoader(context_rows(data, 'X_valid'), y_valid, batch_size=args.BATCH_SIZE, shuffle=args.DATA_SHUFFLE)
+        test_dataloader = FastTensorLoader(context_rows(data, 'test'), batch_size=args.BATCH_SIZE, shuffle=False)
 
-    data['train_dataloader'], data['valid_dataloader'], data['test_dataloader'] = train_dataloader, valid_dataloader, test_dataloader
+        data['train_dataloader'], data['valid_dataloader'], data['test_dataloader'] = train_dataloader, valid_dataloader, test_dataloader
 
     return data
@@ -0,0 +1,86 @@
+import os
+import pickle
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from src.data.store import STORE_DIR, input_mtime
+
+
+USER_FIELDS = ['location_city', 'location_state', 'location_country']
+BOOK_FIELDS = ['category', 'publisher', 'book_author']
+
+
+class FeatureEncoder:
+    """
+    user_id / isbn 과 범주형 컬럼들의 값 -> 인덱스 매핑.
+    pd.factorize 로 한 번 만들고 pickle 로 저장해서 모든 loader 와 추론에서 같은 매핑을 씁니다.
+    """
+    def __init__(self, vocab=None):
+        self.vocab = vocab if vocab is not None else {}
+
+    def fit(self, name, values):
+        codes, uniques = pd.factorize(pd.Series(values))
+        uniques = pd.Index(uniques)
+        # factorize 는 NaN 을 -1 로 빼버리므로 기존 dict 매핑처럼 NaN 도 하나의 값으로 둡니다.
+        if (codes == -1).any():
+            uniques = uniques.append(pd.Index([np.nan]))
+        self.vocab[name] = uniques
+        return self
+
+    def transform(self, name, values) -> np.ndarray:
+        """
+        없는 값은 -1 로 인코딩됩니다.
+        """
+        return self.vocab[name].get_indexer(values).astype(np.int32)
+
+    def inverse_transform(self, name, codes) -> np.ndarray:
+        return self.vocab[name].take(np.asarray(codes)).values
+
+    def size(self, name) -> int:
+        return len(self.vocab[name])
+
+    def save(self, path):
+        # 같은 파일을 읽는 다른 process 가 쓰다 만 pickle 을 보지 않도록 새 파일에 쓰고 바꿔 끼움
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = Path(f'{path}.{os.getpid()}')
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(self.vocab, f)
+        os.replace(str(tmp_path), str(path))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            return cls(pickle.load(f))
+
+
+def build_encoder(users, books, train, sub) -> FeatureEncoder:
+    encoder = FeatureEncoder()
+    encoder.fit('user_id', pd.concat([train['user_id'], sub['user_id']]))
+    encoder.fit('isbn', pd.concat([train['isbn'], sub['isbn']]))
+
+    # 평점에 등장하는 user / book 의 값만 vocab 에 들어가도록 인코딩된 id 순서로 정렬한 테이블에서 학습
+    user_table = users.drop_duplicates('user_id').set_index('user_id').reindex(encoder.vocab['user_id'])
+    book_table = books.drop_duplicates('isbn').set_index('isbn').reindex(encoder.vocab['isbn'])
+    for column in USER_FIELDS:
+        encoder.fit(column, user_table[column])
+    for column in BOOK_FIELDS:
+        encoder.fit(column, book_table[column])
+    return encoder
+
+
+def load_encoder(args, users, books, train, sub) -> FeatureEncoder:
+    """
+    DATA_PATH/store/encoders/uXX_bXX.pkl 이 입력 파일보다 새로우면 불러오고, 아니면 새로 만들어 저장합니다.
+    """
+    formatted_user_num = format(args.USER_NUM, '02')
+    formatted_book_num = format(args.BOOK_NUM, '02')
+    ppath = Path(args.DATA_PATH, STORE_DIR, 'encoders', f'u{formatted_user_num}_b{formatted_book_num}.pkl')
+    if ppath.exists() and ppath.stat().st_mtime >= input_mtime(args):
+        return FeatureEncoder.load(ppath)
+
+    encoder = build_encoder(users, books, train, sub)
+    encoder.save(ppath)
+    return encoder
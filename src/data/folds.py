@@ -0,0 +1,125 @@
+import os
+import hashlib
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import torch
+from sklearn.model_selection import StratifiedKFold
+
+from src.data.store import STORE_DIR
+from src.data.schema import code_tensor
+
+FOLD_DIR = 'folds'
+
+
+class FoldPlan:
+    """
+    StratifiedKFold(shuffle, random_state=SEED) 의 fold 배정을 한 번만 계산해서
+    {DATA_PATH}/store/folds/{label hash}_{N_SPLITS}_{SEED}.npz 에 저장해두고 재실행 때 그대로 읽습니다.
+    split() 은 StratifiedKFold.split 과 같은 (train_index, valid_index) 를 fold 순서대로 돌려줍니다.
+    """
+    def __init__(self, args, labels):
+        labels = np.asarray(labels)
+        self.n_splits = args.N_SPLITS
+        key = hashlib.sha1(np.ascontiguousarray(labels).tobytes()).hexdigest()[:16]
+        self.path = Path(args.DATA_PATH, STORE_DIR, FOLD_DIR, f'{key}_{args.N_SPLITS}_{args.SEED}.npz')
+
+        if self.path.exists():
+            self.fold = np.load(str(self.path))['fold']
+        else:
+            skf = StratifiedKFold(n_splits=args.N_SPLITS, shuffle=True, random_state=args.SEED)
+            self.fold = np.empty(len(labels), dtype=np.int8)
+            for idx, (_, valid_index) in enumerate(skf.split(np.zeros(len(labels)), labels)):
+                self.fold[valid_index] = idx
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # 같은 plan 을 동시에 만드는 process (sweep.py 등) 가 덜 쓴 파일을 읽지 않도록 pid 임시 파일에 쓰고 바꿔 끼움
+            tmp_path = Path(f'{self.path}.{os.getpid()}.tmp')
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, fold=self.fold)
+            os.replace(str(tmp_path), str(self.path))
+        assert len(self.fold) == len(labels), f'{self.path} 의 길이가 label 과 다릅니다.'
+
+    def __len__(self):
+        return self.n_splits
+
+    def fold_index(self, idx):
+        return np.flatnonzero(self.fold != idx), np.flatnonzero(self.fold == idx)
+
+    def split(self):
+        for idx in range(self.n_splits):
+            yield self.fold_index(idx)
+
+
+class FoldView:
+    """
+    base tensor 하나의 일부 행(index) / 컬럼만 보는 view. 행을 복사하지 않고, 읽을 때 index 로 모읍니다.
+    k-fold 에서 fold 마다 DataFrame 을 잘라 tensor 를 새로 만드는 대신 씁니다.
+    view[['user_id', 'isbn']], view['img_index'] 로 컬럼을, view[rows] 로 행을 고르고,
+    DataFrame 처럼 .values 로 그대로 Dataset / FastTensorLoader 에 넘길 수 있습니다.
+    읽은 행을 batch 로 펼치는 방식(expand)은 subclass 에서 바꿀 수 있습니다. (ex. ContextRows)
+    """
+    def __init__(self, base: torch.Tensor, columns: list, index=None, positions=None):
+        self.base = base
+        self.columns = columns
+        self.index = torch.arange(len(base)) if index is None else torch.as_tensor(index, dtype=torch.long)
+        self.positions = positions
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, dtype=None):
+        base = code_tensor(df.values) if dtype is None else torch.tensor(df.values, dtype=dtype)
+        return cls(base, list(df.columns))
+
+    def view(self, index, positions):
+        return FoldView(self.base, self.columns, index, positions)
+
+    def rows(self, index):
+        return self.view(self.index[torch.as_tensor(index, dtype=torch.long)], self.positions)
+
+    def expand(self, batch):
+        return batch
+
+    def frame(self) -> pd.DataFrame:
+        """
+        view 의 행 전체를 DataFrame 으로 모읍니다. (GBM 처럼 DataFrame 을 받는 모델용)
+        """
+        columns = self.columns if self.positions is None else list(np.array(self.columns)[self.positions])
+        return pd.DataFrame(self[:].numpy(), columns=columns)
+
+    @property
+    def values(self):
+        return self
+
+    @property
+    def shape(self):
+        if self.positions is None:
+            return (len(self.index), len(self.columns))
+        if isinstance(self.positions, int):
+            return (len(self.index),)
+        return (len(self.index), len(self.positions))
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.view(self.index, self.columns.index(key))
+        if isinstance(key, list) and key and isinstance(key[0], str):
+            return self.view(self.index, [self.columns.index(column) for column in key])
+        if isinstance(key, np.ndarray):
+            key = torch.from_numpy(key)
+        batch = self.expand(self.base[self.index[key]])
+        if self.positions is not None:
+            batch = batch[:, self.positions]
+        return batch
+
+
+def as_rows(values, dtype=None):
+    """
+    FoldView 는 그대로 (batch 마다 index 로 읽음), 배열은 dtype (없으면 schema 의 code dtype) tensor 로 복사합니다.
+    """
+    if isinstance(values, FoldView):
+        return values
+    if dtype is None:
+        return code_tensor(values)
+    return torch.tensor(np.asarray(values), dtype=dtype)
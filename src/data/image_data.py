@@ -1,111 +1,174 @@
+import os
+import fcntl
+from pathlib import Path
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import pandas as pd
 from PIL import Image
 from sklearn.model_selection import train_test_split
-import torchvision.transforms as transforms
 import torch
 from torch.utils.data import DataLoader, Dataset
-from torch.autograd import Variable
 from tqdm import tqdm
 from src.utils import EarlyStopping
+from src.data.context_data import encode_inputs
+from src.data.batch import WeightedBatchSampler
+from src.data.folds import as_rows
+from src.data.store import STORE_DIR
+from src.data.lazy import LazyData
 
 class Image_Dataset(Dataset):
-    def __init__(self, user_isbn_vector, img_vector, label):
-        self.user_isbn_vector = user_isbn_vector
-        self.img_vector = img_vector
-        self.label = label
+    """
+    행마다 user_id / isbn 과 이미지 store 의 행 번호(img_index) 만 들고, 이미지는 uint8 store 하나를 같이 씁니다.
+    __getitem__ 은 행 번호만 돌려주고, collate 에서 batch 단위로 한 번에 모아 float 로 바꿉니다.
+    """
+    def __init__(self, user_isbn_vector, img_index, label, images):
+        self.user_isbn_vector = as_rows(user_isbn_vector)
+        self.img_index = as_rows(img_index)
+        self.label = torch.tensor(np.asarray(label), dtype=torch.float32)
+        self.images = images
     def __len__(self):
         return self.user_isbn_vector.shape[0]
     def __getitem__(self, i):
+        return i
+    def collate(self, batch):
+        index = torch.as_tensor(batch, dtype=torch.long)
+        img_vector = torch.from_numpy(np.asarray(self.images[self.img_index[index].numpy()]))
         return {
-                'user_isbn_vector' : torch.tensor(self.user_isbn_vector[i], dtype=torch.long),
-                'img_vector' : torch.tensor(self.img_vector[i], dtype=torch.float32),
-                'label' : torch.tensor(self.label[i], dtype=torch.float32),
+                'user_isbn_vector' : self.user_isbn_vector[index],
+                'img_vector' : img_vector.float().div_(255),
+                'label' : self.label[index],
                 }
 
 
-def image_vector(path):
-    img = Image.open(path)
-    scale = transforms.Resize((32, 32))
-    tensor = transforms.ToTensor()
-    img_fe = Variable(tensor(scale(img)))
-    return img_fe
-
-
-def process_img_data(df, books, user2idx, isbn2idx, train=False):
-    books_ = books.copy()
-    books_['isbn'] = books_['isbn'].map(isbn2idx)
-
-    if train == True:
-        df_ = df.copy()
-    else:
-        df_ = df.copy()
-        df_['user_id'] = df_['user_id'].map(user2idx)
-        df_['isbn'] = df_['isbn'].map(isbn2idx)
-
-    df_ = pd.merge(df_, books_[['isbn', 'img_path']], on='isbn', how='left')
-    df_['img_path'] = df_['img_path'].apply(lambda x: 'data/'+x)
-    img_vector_df = df_[['img_path']].drop_duplicates().reset_index(drop=True).copy()
-    data_box = []
-    for idx, path in tqdm(enumerate(sorted(img_vector_df['img_path']))):
-        data = image_vector(path)
-        if data.size()[0] == 3:
-            data_box.append(np.array(data))
-        else:
-            data_box.append(np.array(data.expand(3, data.size()[1], data.size()[2])))
-    img_vector_df['img_vector'] = data_box
-    df_ = pd.merge(df_, img_vector_df, on='img_path', how='left')
+IMAGE_SIZE = 32
+IMAGE_DIR = 'data'
+
+
+def decode_image(path) -> np.ndarray:
+    """
+    이미지 한 장 -> (3, IMAGE_SIZE, IMAGE_SIZE) uint8. JPEG 는 draft 모드로 decode 단계에서 미리 줄입니다.
+    흑백 / 팔레트 이미지도 RGB 로 맞춥니다. (기존 image_vector 의 Resize + ToTensor 를 uint8 로 저장하는 것과 같음)
+    """
+    with Image.open(path) as img:
+        img.draft('RGB', (IMAGE_SIZE, IMAGE_SIZE))
+        img = img.convert('RGB').resize((IMAGE_SIZE, IMAGE_SIZE), Image.BILINEAR)
+        return np.asarray(img, dtype=np.uint8).transpose(2, 0, 1)
+
+
+def image_store_path(args):
+    return Path(args.DATA_PATH, STORE_DIR, f'images_{IMAGE_SIZE}.npy'), Path(args.DATA_PATH, STORE_DIR, f'images_{IMAGE_SIZE}.paths.npy')
+
+
+@contextmanager
+def image_store_lock(args, exclusive: bool):
+    """
+    이미지 store (images / paths 두 파일) 를 읽을 때는 공유, 추가할 때는 배타 lock.
+    여러 process 가 동시에 추가해도 서로의 행을 덮어쓰지 않고, 두 파일이 어긋난 상태를 읽지 않게 합니다.
+    """
+    lock_path = Path(args.DATA_PATH, STORE_DIR, f'images_{IMAGE_SIZE}.lock')
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(lock_path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def read_image_store(args):
+    """
+    image_store_lock 안에서 부릅니다. return: img_path 배열, 이미지 배열 (memory map)
+    """
+    images_path, paths_path = image_store_path(args)
+    if images_path.exists() and paths_path.exists():
+        return np.load(str(paths_path)), np.load(str(images_path), mmap_mode='r')
+    return np.array([], dtype=str), np.zeros((0, 3, IMAGE_SIZE, IMAGE_SIZE), dtype=np.uint8)
+
+
+def load_image_store(args, img_paths):
+    """
+    img_path 들의 (N, 3, 32, 32) uint8 이미지를 DATA_PATH/store 에서 memory map 으로 읽습니다.
+    store 에 없는 이미지만 process pool 로 decode 해서 store 에 추가합니다.
+    store 는 뒤에 덧붙이기만 하므로 먼저 받은 행 번호는 나중에 다시 열어도 그대로입니다.
+    return: 이미지 배열, img_path -> 행 번호 Series
+    """
+    with image_store_lock(args, exclusive=False):
+        paths, images = read_image_store(args)
+
+    missing = pd.Index(img_paths).unique().difference(paths)
+    if len(missing):
+        print(f"[IMAGE STORE] decode {len(missing)} images")
+        with ProcessPoolExecutor() as executor:
+            decoded = np.stack(list(tqdm(executor.map(decode_image, [os.path.join(IMAGE_DIR, x) for x in missing], chunksize=256), total=len(missing))))
+        missing = np.asarray(missing, dtype=str)
+
+        with image_store_lock(args, exclusive=True):
+            # decode 하는 사이 다른 process 가 추가한 행은 그대로 두고, 아직 없는 이미지만 덧붙임
+            paths, images = read_image_store(args)
+            new = ~np.isin(missing, paths)
+            if new.any():
+                images_path, paths_path = image_store_path(args)
+                # 이미 memory map 으로 열려 있는 store 가 깨지지 않도록 새 파일에 쓰고 바꿔 끼움
+                save_array(images_path, np.concatenate([images, decoded[new]]))
+                save_array(paths_path, np.concatenate([paths, missing[new]]))
+                # 실제로 저장된 paths / images 를 같이 돌려줌
+                paths, images = read_image_store(args)
+
+    return images, pd.Series(np.arange(len(paths)), index=paths)
+
+
+def save_array(ppath: Path, array: np.ndarray):
+    tmp_path = Path(f'{ppath}.{os.getpid()}.tmp')
+    with open(tmp_path, 'wb') as f:
+        np.save(f, array)
+    os.replace(str(tmp_path), str(ppath))
+
+
+def process_img_data(df, books, image_index):
+    df_ = pd.merge(df, books[['isbn', 'img_path']], on='isbn', how='left')
+    df_['img_index'] = df_['img_path'].map(image_index).astype(np.int32)
+    df_['img_path'] = df_['img_path'].apply(lambda x: os.path.join(IMAGE_DIR, x))
     return df_
 
 
-def image_data_load(args):
+def image_test_frame(args, books, test):
+    """
+    test 평점의 img_test. test 에만 나오는 책의 이미지는 여기서 decode 해서 store 에 추가합니다.
+    """
+    img_paths = books.loc[books['isbn'].isin(test['isbn'].values), 'img_path']
+    _, image_index = load_image_store(args, img_paths)
+    return process_img_data(test, books, image_index)
 
-    formatted_user_num = format(args.USER_NUM, '02')
-    formatted_book_num = format(args.BOOK_NUM, '02')
-    users = pd.read_csv(args.DATA_PATH + 'users', f'u{args.formatted_user_num}.csv')
-    books = pd.read_csv(args.DATA_PATH + 'books', f'b{args.formatted_book_num}.csv')
-    train = pd.read_csv(args.DATA_PATH + 'ratings/' + 'train_ratings.csv')
-    test = pd.read_csv(args.DATA_PATH + 'ratings/' + 'test_ratings.csv')
-    sub = pd.read_csv(args.DATA_PATH + 'ratings/' + 'sample_submission.csv')
 
-    ids = pd.concat([train['user_id'], sub['user_id']]).unique()
-    isbns = pd.concat([train['isbn'], sub['isbn']]).unique()
-
-    idx2user = {idx:id for idx, id in enumerate(ids)}
-    idx2isbn = {idx:isbn for idx, isbn in enumerate(isbns)}
-
-    user2idx = {id:idx for idx, id in idx2user.items()}
-    isbn2idx = {isbn:idx for idx, isbn in idx2isbn.items()}
-
-    train['user_id'] = train['user_id'].map(user2idx)
-    sub['user_id'] = sub['user_id'].map(user2idx)
+def image_data_load(args):
 
-    train['isbn'] = train['isbn'].map(isbn2idx)
-    sub['isbn'] = sub['isbn'].map(isbn2idx)
+    users, books, train, test, sub, encoder = encode_inputs(args)
 
-    img_train = process_img_data(train, books, user2idx, isbn2idx, train=True)
-    img_test = process_img_data(test, books, user2idx, isbn2idx, train=False)
+    img_paths = books.loc[books['isbn'].isin(train['isbn'].values), 'img_path']
+    images, image_index = load_image_store(args, img_paths)
+    img_train = process_img_data(train, books, image_index)
 
-    data = {
+    data = LazyData({
             'train':train,
             'test':test,
             'users':users,
             'books':books,
             'sub':sub,
-            'idx2user':idx2user,
-            'idx2isbn':idx2isbn,
-            'user2idx':user2idx,
-            'isbn2idx':isbn2idx,
+            'encoder':encoder,
+            'field_dims':np.array([encoder.size('user_id'), encoder.size('isbn')], dtype=np.int64),
             'img_train':img_train,
-            'img_test':img_test,
-            }
+            'images':images,
+            })
+    # img_test 와 test 이미지 decode 는 처음 쓸 때 (test 예측) 합니다.
+    data.lazy('img_test', image_test_frame, args, books, test)
 
     return data
 
 
 def image_data_split(args, data):
     X_train, X_valid, y_train, y_valid = train_test_split(
-                                                        data['img_train'][['user_id', 'isbn', 'img_vector']],
+                                                        data['img_train'][['user_id', 'isbn', 'img_index']],
                                                         data['img_train']['rating'],
                                                         test_size=args.TEST_SIZE,
                                                         random_state=args.SEED,
@@ -118,23 +181,35 @@ def image_data_split(args, data):
 def image_data_loader(args, data):
     train_dataset = Image_Dataset(
                                 data['X_train'][['user_id', 'isbn']].values,
-                                data['X_train']['img_vector'].values,
-                                data['y_train'].values
+                                data['X_train']['img_index'].values,
+                                data['y_train'].values,
+                                data['images']
                                 )
     valid_dataset = Image_Dataset(
                                 data['X_valid'][['user_id', 'isbn']].values,
-                                data['X_valid']['img_vector'].values,
-                                data['y_valid'].values
+                                data['X_valid']['img_index'].values,
+                                data['y_valid'].values,
+                                data['images']
                                 )
-    test_dataset = Image_Dataset(
-                                data['img_test'][['user_id', 'isbn']].values,
-                                data['img_test']['img_vector'].values,
-                                data['img_test']['rating'].values
-                                )
-
-    train_dataloader = torch.utils.data.DataLoader(train_dataset, batch_size=args.BATCH_SIZE, shuffle=True, num_workers = 4)
-    valid_dataloader = torch.utils.data.DataLoader(valid_dataset, batch_size=args.BATCH_SIZE, shuffle=True, num_workers = 4)
-    test_dataloader = torch.utils.data.DataLoader(test_dataset, batch_size=args.BATCH_SIZE,  shuffle=False, num_workers = 4)
-    data['train_dataloader'], data['valid_dataloader'], data['test_dataloader'] = train_dataloader, valid_dataloader, test_dataloader
+    if args.WEIGHTED_SAMPLER:
+        sampler = WeightedBatchSampler(data['y_train'].values, args.BATCH_SIZE)
+        train_dataloader = torch.utils.data.DataLoader(train_dataset, batch_sampler=sampler, num_workers = 4, collate_fn=train_dataset.collate)
+    else:
+        train_dataloader = torch.utils.data.DataLoader(train_dataset, batch_size=args.BATCH_SIZE, shuffle=True, num_workers = 4, collate_fn=train_dataset.collate)
+    valid_dataloader = torch.utils.data.DataLoader(valid_dataset, batch_size=args.BATCH_SIZE, shuffle=True, num_workers = 4, collate_fn=valid_dataset.collate)
+    data['train_dataloader'], data['valid_dataloader'] = train_dataloader, valid_dataloader
+    data.lazy('test_dataloader', image_test_dataloader, args, data.ref('img_test'))
 
     return data
+
+
+def image_test_dataloader(args, img_test):
+    # img_test 를 만들면서 store 에 추가된 test 이미지까지 보이도록 store 를 다시 엶
+    images, _ = load_image_store(args, [])
+    test_dataset = Image_Dataset(
+                                img_test[['user_id', 'isbn']].values,
+                                img_test['img_index'].values,
+                                img_test['rating'].values,
+                                images
+                                )
+    return torch.utils.data.DataLoader(test_dataset, batch_size=args.BATCH_SIZE,  shuffle=False, num_workers = 4, collate_fn=test_dataset.collate)
@@ -0,0 +1,68 @@
+class Thunk:
+    """
+    fn(*args) 를 처음 부를 때 한 번만 계산하고 결과를 들고 있는 thunk.
+    args 중 Thunk 는 먼저 계산해서 넘기므로 lazy 값끼리 이어 쓸 수 있습니다. (ex. test -> test_dataloader)
+    fn 이 module 의 함수면 pickle 되어 process pool 로도 넘길 수 있습니다.
+    """
+    def __init__(self, fn, *args):
+        self.fn = fn
+        self.args = args
+        self.done = False
+        self.value = None
+
+    @classmethod
+    def of(cls, value):
+        thunk = cls(None)
+        thunk.done, thunk.value = True, value
+        return thunk
+
+    def __call__(self):
+        if not self.done:
+            self.value = self.fn(*[arg() if isinstance(arg, Thunk) else arg for arg in self.args])
+            # 계산이 끝난 입력은 놓아줌
+            self.fn, self.args, self.done = None, (), True
+        return self.value
+
+
+class LazyData(dict):
+    """
+    *_data_load / *_data_split / *_data_loader 가 돌려주는 data dict.
+    lazy(key, fn, *args) 로 넣은 값은 처음 data[key] 로 읽을 때 만들고 저장해서 다시 씁니다.
+    test 쪽처럼 valid rmse 만 보는 run 에서는 쓰지 않는 값을 만들지 않게 합니다.
+    """
+    def __init__(self, values=None, thunks=None):
+        super().__init__(values or {})
+        self.thunks = dict(thunks or {})
+
+    def lazy(self, key, fn, *args):
+        dict.pop(self, key, None)
+        self.thunks[key] = Thunk(fn, *args)
+        return self
+
+    def ref(self, key) -> Thunk:
+        """
+        data[key] 를 나중에 읽는 Thunk. 아직 만들지 않은 값이면 같은 Thunk 를 같이 씁니다.
+        """
+        if key in self.thunks:
+            return self.thunks[key]
+        return Thunk.of(self[key])
+
+    def __missing__(self, key):
+        if key not in self.thunks:
+            raise KeyError(key)
+        value = self.thunks.pop(key)()
+        dict.__setitem__(self, key, value)
+        return value
+
+    def __setitem__(self, key, value):
+        self.thunks.pop(key, None)
+        dict.__setitem__(self, key, value)
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or key in self.thunks
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def __reduce__(self):
+        return LazyData, (dict(self), self.thunks)
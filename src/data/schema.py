@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+import torch
+
+
+# 인코딩된 코드(범주 인덱스, bucket, 평점)는 값 범위를 담는 가장 작은 signed 정수로 들고 있다가
+# 모델의 embedding lookup (FeaturesEmbedding / FeaturesLinear / FieldAwareFactorizationMachine) 에서만 long 으로 넓힙니다.
+# encoder 에 없는 값이 -1 이므로 unsigned 는 쓰지 않습니다.
+CODE_DTYPES = (np.int8, np.int16, np.int32, np.int64)
+TARGET_DTYPE = torch.float32
+RATING_MAX = 10
+
+
+def code_dtype(size: int) -> np.dtype:
+    """
+    -1 ~ size 의 코드를 담는 가장 작은 정수 dtype.
+    """
+    for dtype in CODE_DTYPES:
+        if size <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    raise ValueError(f'{size} 는 int64 로 담을 수 없습니다.')
+
+
+def torch_dtype(dtype) -> torch.dtype:
+    return torch.from_numpy(np.empty(0, dtype=dtype)).dtype
+
+
+def code_tensor(values, size=None) -> torch.Tensor:
+    """
+    코드 배열을 code_dtype tensor 로 만듭니다. size 를 안 주면 값의 최댓값으로 정합니다.
+    """
+    values = np.asarray(values)
+    if size is None:
+        size = int(values.max()) if values.size else 0
+    return torch.from_numpy(np.ascontiguousarray(values, dtype=code_dtype(size)))
+
+
+def target_tensor(values) -> torch.Tensor:
+    return torch.tensor(np.asarray(values), dtype=TARGET_DTYPE)
+
+
+def apply_schema(df: pd.DataFrame, sizes: dict) -> pd.DataFrame:
+    """
+    sizes 의 컬럼만 남기고 컬럼마다 code_dtype(size) 로 바꿉니다.
+    """
+    return pd.DataFrame({column: df[column].values.astype(code_dtype(size)) for column, size in sizes.items()})
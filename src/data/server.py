@@ -0,0 +1,163 @@
+import os
+import json
+import shutil
+import socket
+import hashlib
+import argparse
+import threading
+import socketserver
+from pathlib import Path
+
+import numpy as np
+
+from src.data.store import feather, input_mtime
+from src.data.encoder import FeatureEncoder
+
+
+SOCKET_PATH = '/tmp/bookrating_data.sock'
+SHM_DIR = '/dev/shm/bookrating'
+FRAME_NAMES = ('train', 'test')
+CONTEXT_META = 'context.json'
+
+
+def request(socket_path: str, message: dict) -> dict:
+    """
+    json 한 줄을 보내고 json 한 줄을 받습니다.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall((json.dumps(message) + '\n').encode('utf-8'))
+        return json.loads(sock.makefile('r', encoding='utf-8').readline())
+
+
+def attach_context(args):
+    """
+    DATA_SERVER 가 떠 있으면 context_inputs 결과(train / test 코드, field_dims, encoder, ContextTable)를
+    서버가 /dev/shm 에 올려둔 압축 없는 feather / npy 에서 memory map 으로 읽습니다.
+    같은 경우의 수를 쓰는 process 들은 한 번 인코딩된 같은 메모리를 같이 보고, ContextTable 도 다시 만들지 않습니다.
+    서버에 연결할 수 없으면 None (캐시 / 직접 읽음).
+    """
+    if feather is None:
+        return None
+    message = {'DATA_PATH': os.path.abspath(args.DATA_PATH), 'USER_NUM': args.USER_NUM, 'BOOK_NUM': args.BOOK_NUM}
+    try:
+        reply = request(args.DATA_SERVER, message)
+    except OSError as e:
+        print(f'[DATA SERVER] {args.DATA_SERVER} 에 연결할 수 없어 서버 없이 (캐시 / 직접) 읽습니다. ({e})')
+        return None
+    if 'error' in reply:
+        raise RuntimeError(f"[DATA SERVER] {reply['error']}")
+
+    # context_data 가 이 모듈의 attach_context 를 import 하므로 여기서 import
+    from src.data.context_data import ContextTable
+
+    print(f"[DATA SERVER] attach {reply['dir']}")
+    ppath = Path(reply['dir'])
+    # 코드 컬럼은 모두 정수라 split_blocks 로 읽으면 memory map 을 복사하지 않고 씀
+    data = {name: feather.read_table(str(ppath / f'{name}.feather'), memory_map=True).to_pandas(split_blocks=True)
+            for name in FRAME_NAMES}
+    with open(ppath / CONTEXT_META) as f:
+        meta = json.load(f)
+    # copy-on-write memory map: page 는 process 끼리 같이 쓰고, torch.from_numpy 로도 감쌀 수 있음
+    tables = {column: np.load(str(ppath / f'context.{column}.npy'), mmap_mode='c') for column in meta['tables']}
+    matrices = [np.load(str(ppath / f'{name}.npy'), mmap_mode='c') for name in ('user_matrix', 'book_matrix')]
+    data['context'] = ContextTable.from_arrays(meta['field_sizes'], meta['columns'], tables, matrices)
+    data['field_dims'] = np.load(str(ppath / 'field_dims.npy'))
+    data['encoder'] = FeatureEncoder.load(ppath / 'encoder.pkl')
+    return data
+
+
+def write_context(ppath: Path, data: dict):
+    """
+    context_inputs 결과를 ppath 에 압축 없는 feather (train / test 코드) 와 npy (ContextTable 배열) 로 씁니다.
+    """
+    for name in FRAME_NAMES:
+        feather.write_feather(data[name].reset_index(drop=True), str(ppath / f'{name}.feather'), compression='uncompressed')
+    context = data['context']
+    for column, table in context.tables.items():
+        np.save(str(ppath / f'context.{column}.npy'), table)
+    np.save(str(ppath / 'user_matrix.npy'), context.user_matrix.numpy())
+    np.save(str(ppath / 'book_matrix.npy'), context.book_matrix.numpy())
+    np.save(str(ppath / 'field_dims.npy'), data['field_dims'])
+    with open(ppath / CONTEXT_META, 'w') as f:
+        json.dump({'field_sizes': context.field_sizes, 'columns': context.columns, 'tables': list(context.tables)}, f, indent=4)
+    data['encoder'].save(ppath / 'encoder.pkl')
+
+
+class DataServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    (DATA_PATH, USER_NUM, BOOK_NUM) 마다 context_inputs 를 한 번만 실행해서
+    {shm_dir}/{경우의 수}/ 에 인코딩된 코드 / ContextTable 배열 (write_context) 로 올려두고 경로를 알려주는 서버.
+    입력 파일이 바뀌면 (input_mtime) 새 디렉토리에 다시 올립니다.
+    """
+    daemon_threads = True
+
+    def __init__(self, socket_path, shm_dir):
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        super().__init__(socket_path, DataHandler)
+        self.shm_dir = shm_dir
+        self.published = {}  # key -> (input mtime, dir)
+        self.locks = {}
+        self.lock = threading.Lock()
+
+    def publish(self, DATA_PATH, USER_NUM, BOOK_NUM) -> str:
+        # context_data 가 이 모듈의 attach_context 를 import 하므로 여기서 import
+        from src.data.context_data import context_inputs
+
+        args = argparse.Namespace(DATA_PATH=DATA_PATH, USER_NUM=USER_NUM, BOOK_NUM=BOOK_NUM, DATA_SERVER=None)
+        key = (DATA_PATH, USER_NUM, BOOK_NUM)
+        with self.lock:
+            lock = self.locks.setdefault(key, threading.Lock())
+
+        with lock:
+            mtime = input_mtime(args)
+            if key in self.published and self.published[key][0] >= mtime:
+                return self.published[key][1]
+
+            name = f"{hashlib.sha1(DATA_PATH.encode('utf-8')).hexdigest()[:8]}_u{USER_NUM:02d}_b{BOOK_NUM:02d}_{int(mtime)}"
+            ppath = Path(self.shm_dir, name)
+            tmp_path = Path(self.shm_dir, name + '.tmp')
+            shutil.rmtree(str(tmp_path), ignore_errors=True)
+            tmp_path.mkdir(parents=True)
+
+            write_context(tmp_path, context_inputs(args))
+            shutil.rmtree(str(ppath), ignore_errors=True)
+            os.rename(str(tmp_path), str(ppath))
+
+            # 예전 디렉토리는 지워도 이미 attach 한 process 의 memory map 은 그대로 유효
+            if key in self.published and self.published[key][1] != str(ppath):
+                shutil.rmtree(self.published[key][1], ignore_errors=True)
+            self.published[key] = (mtime, str(ppath))
+            print(f'[DATA SERVER] publish {ppath}')
+            return str(ppath)
+
+
+class DataHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            message = json.loads(self.rfile.readline())
+            reply = {'dir': self.server.publish(message['DATA_PATH'], int(message['USER_NUM']), int(message['BOOK_NUM']))}
+        except Exception as e:
+            reply = {'error': repr(e)}
+        self.wfile.write((json.dumps(reply) + '\n').encode('utf-8'))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='encode 된 데이터를 /dev/shm 으로 공유하는 로컬 서버')
+    parser.add_argument('--SOCKET', type=str, default=SOCKET_PATH, help='main.py --DATA_SERVER 로 넘길 Unix socket 경로입니다.')
+    parser.add_argument('--SHM_DIR', type=str, default=SHM_DIR, help='encode 된 데이터를 올려둘 공유 메모리 디렉토리입니다.')
+    args = parser.parse_args()
+    if feather is None:
+        raise ImportError('data server 에는 pyarrow 가 필요합니다. `pip install pyarrow`')
+
+    server = DataServer(args.SOCKET, args.SHM_DIR)
+    print(f'[DATA SERVER] listening on {args.SOCKET}, shared memory: {args.SHM_DIR}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(args.SOCKET)
+        shutil.rmtree(args.SHM_DIR, ignore_errors=True)
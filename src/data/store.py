@@ -0,0 +1,169 @@
+import os
+import json
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# variant 컬럼 선택은 preprocess 가 쓰는 구현을 그대로 씀 (dtype 등이 어긋나지 않게)
+from preprocess.variants import select_variant
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:
+    pa = None
+    feather = None
+
+
+STORE_DIR = 'store'
+STORE_SOURCES = ('users', 'books', 'ratings')
+VARIANT_SPEC = 'variants.json'
+VARIANT_BASES = {'users': 'users/users_base.csv', 'books': 'books/books_base.csv'}
+RATING_NAMES = ['ratings/train_ratings.csv', 'ratings/test_ratings.csv', 'ratings/sample_submission.csv']
+FRAME_CACHE = None  # cache_frames() 이후에는 {(data_path, name): DataFrame}
+
+
+def store_path(data_path: str, name: str) -> Path:
+    """
+    'users/u01.csv' -> '{data_path}/store/users/u01.feather'
+    """
+    return Path(data_path, STORE_DIR, name).with_suffix('.feather')
+
+
+def write_store(data_path: str, sources=STORE_SOURCES) -> list:
+    """
+    users/, books/, ratings/ 아래의 csv 를 한 번만 파싱해서
+    압축 없는 feather(Arrow IPC) 파일로 저장합니다. 압축이 없어야 memory map 으로 읽을 수 있습니다.
+    """
+    if feather is None:
+        raise ImportError('store 변환에는 pyarrow 가 필요합니다. `pip install pyarrow`')
+
+    written = []
+    for source in sources:
+        source_dir = Path(data_path, source)
+        if not source_dir.is_dir():
+            continue
+        for csv_path in sorted(source_dir.glob('*.csv')):
+            name = os.path.join(source, csv_path.name)
+            ppath = store_path(data_path, name)
+            ppath.parent.mkdir(parents=True, exist_ok=True)
+            df = pd.read_csv(csv_path)
+            feather.write_feather(df, str(ppath), compression='uncompressed')
+            written.append(ppath)
+            print(f"[STORE] {name} -> {ppath}")
+    return written
+
+
+def cache_frames():
+    """
+    이후 load_frame 이 읽은 테이블을 process 안에 보관하고 복사본을 돌려줍니다.
+    한 process 에서 여러 경우의 수를 돌릴 때 (sweep.py) base / ratings 테이블을 한 번만 읽기 위해 씁니다.
+    """
+    global FRAME_CACHE
+    if FRAME_CACHE is None:
+        FRAME_CACHE = {}
+
+
+def read_frame(data_path: str, name: str) -> pd.DataFrame:
+    """
+    store 에 변환된 파일이 있고 원본 csv 보다 새로우면 memory map + 멀티스레드로 읽고,
+    아니면 기존처럼 csv 를 읽습니다.
+    """
+    csv_path = Path(data_path, name)
+    ppath = store_path(data_path, name)
+    if feather is not None and ppath.exists() \
+            and (not csv_path.exists() or ppath.stat().st_mtime >= csv_path.stat().st_mtime):
+        table = feather.read_table(str(ppath), memory_map=True, use_threads=True)
+        return table.to_pandas(use_threads=True)
+    return pd.read_csv(csv_path)
+
+
+def load_frame(data_path: str, name: str) -> pd.DataFrame:
+    if FRAME_CACHE is None:
+        return read_frame(data_path, name)
+    key = (str(data_path), name)
+    if key not in FRAME_CACHE:
+        FRAME_CACHE[key] = read_frame(data_path, name)
+    # 호출하는 쪽에서 컬럼을 덮어쓰므로 (encode_inputs) 보관본은 건드리지 않게 복사
+    return FRAME_CACHE[key].copy()
+
+
+def variant_spec(data_path: str, source: str):
+    """
+    preprocess 가 저장한 {source}/variants.json. 없으면 (예전 uXX / bXX csv 만 있는 경우) None.
+    """
+    spec_path = Path(data_path, source, VARIANT_SPEC)
+    if not spec_path.exists():
+        return None
+    with open(spec_path) as f:
+        return json.load(f)
+
+
+def variant_names(args) -> list:
+    return [('users', 'u' + format(args.USER_NUM, '02')), ('books', 'b' + format(args.BOOK_NUM, '02'))]
+
+
+def load_variant(data_path: str, source: str, variant: str) -> pd.DataFrame:
+    """
+    users / books 의 한 경우의 수(ex. u01, b05)를 base 테이블에서 메모리로 골라냅니다.
+    spec 이 없으면 기존처럼 {source}/{variant}.csv 를 읽습니다.
+    """
+    spec = variant_spec(data_path, source)
+    if spec is None or variant not in spec:
+        return load_frame(data_path, os.path.join(source, variant + '.csv'))
+    return select_variant(load_frame(data_path, VARIANT_BASES[source]), spec[variant])
+
+
+def input_names(args) -> list:
+    """
+    USER_NUM / BOOK_NUM 에 실제로 쓰이는 입력 파일들 (base 테이블 + spec, 또는 uXX / bXX csv).
+    """
+    names = []
+    for source, variant in variant_names(args):
+        spec = variant_spec(args.DATA_PATH, source)
+        if spec is None or variant not in spec:
+            names.append(os.path.join(source, variant + '.csv'))
+        else:
+            names += [VARIANT_BASES[source], os.path.join(source, VARIANT_SPEC)]
+    return names + RATING_NAMES
+
+
+def input_mtime(args) -> float:
+    """
+    입력 csv / store 파일 중 가장 최근 수정 시각. 입력으로부터 만든 캐시가 낡았는지 확인할 때 씁니다.
+    """
+    mtimes = []
+    for name in input_names(args):
+        for ppath in (Path(args.DATA_PATH, name), store_path(args.DATA_PATH, name)):
+            if ppath.exists():
+                mtimes.append(ppath.stat().st_mtime)
+    return max(mtimes) if mtimes else 0.0
+
+
+def load_inputs(args):
+    """
+    모든 *_data_load 에서 공통으로 쓰는 users / books / train / test / sub 로딩.
+    """
+    users, books = [load_variant(args.DATA_PATH, source, variant) for source, variant in variant_names(args)]
+    train, test, sub = [load_frame(args.DATA_PATH, name) for name in RATING_NAMES]
+    return users, books, train, test, sub
+
+
+def load_embedding(save_dir: str, name: str):
+    """
+    preprocess/embedding_store.py 로 저장한 embedding. 행렬은 memory map 으로 열어서 복사하지 않습니다.
+    return: ids (행 순서의 user_id / isbn), (N, dim) float32 행렬
+    """
+    ids_path = Path(save_dir, f'{name}.ids.npy')
+    if not ids_path.exists():
+        raise FileNotFoundError(f'{ids_path} 가 없습니다. preprocess/feature2npy.py 로 embedding store 를 다시 만들어주세요.')
+    return np.load(str(ids_path)), np.load(str(Path(save_dir, f'{name}.npy')), mmap_mode='r')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='csv -> feather store 변환')
+    parser.add_argument('--DATA_PATH', type=str, default='/opt/ml/data/', help='Data path를 설정할 수 있습니다.')
+    args = parser.parse_args()
+    write_store(args.DATA_PATH)
@@ -8,9 +8,24 @@ from sklearn.model_selection import train_test_split
 from tqdm import tqdm
 import torch
 from torch.utils.data import DataLoader, Dataset
-from torch.utils.data import WeightedRandomSampler
+from src.data.batch import WeightedBatchSampler
+from src.data.folds import as_rows
 from torch.autograd import Variable
 from transformers import BertModel, BertTokenizer
+from src.data.context_data import context_inputs, shared_inputs
+from src.data.store import load_embedding
+from src.data.cache import load_cached, save_cached
+from src.data.lazy import LazyData
+
+
+EMBEDDING_DIR = '/opt/ml/data/embedding'
+# (id 컬럼, embedding store 이름, text frame 컬럼)
+TEXT_VECTORS = [
+    ('user_id', 'user_summary_merge_vector', 'user_summary_merge_vector'),
+    ('isbn', 'item_summary_vector', 'item_summary_vector'),
+    ('isbn', 'book_title_vector', 'item_title_vector'),
+    ('isbn', 'image_embed', 'item_image_vector'),
+]
 
 
 # def text_preprocessing(summary):
@@ -25,34 +40,6 @@ from transformers import BertModel, BertTokenizer
 #     return " ".join(df[df['user_id'] == user_id].sort_values(by='summary_length', ascending=False)['summary'].values[:max_summary])
 
 
-def age_map(x: int) -> int:
-    x = int(x)
-    if x < 20:
-        return 1
-    elif x >= 20 and x < 30:
-        return 2
-    elif x >= 30 and x < 40:
-        return 3
-    elif x >= 40 and x < 50:
-        return 4
-    elif x >= 50 and x < 60:
-        return 5
-    else:
-        return 6
-
-
-def year_of_publication_map(x: int) -> int:
-    x = int(x)
-    if x < 1991:
-        return 1
-    elif x >= 1991 and x < 1996:
-        return 2
-    elif x >= 1996 and x < 2000:
-        return 3
-    else:
-        return 4
-
-
 class StandardScaler:
     def __init__(self):
         self.train_mean = None
@@ -66,206 +53,105 @@ class StandardScaler:
         return (df - self.train_mean) / self.train_std
 
 
-def process_context_data(users, books, ratings1, ratings2):
-    ratings = pd.concat([ratings1, ratings2]).reset_index(drop=True)
-
-    # 인덱싱 처리된 데이터 조인
-    context_df = ratings.merge(users, on='user_id', how='left').merge(books[['isbn', 'category', 'publisher', 'year_of_publication', 'book_author']], on='isbn', how='left')
-    train_df = ratings1.merge(users, on='user_id', how='left').merge(books[['isbn', 'category', 'publisher', 'year_of_publication', 'book_author']], on='isbn', how='left')
-    test_df = ratings2.merge(users, on='user_id', how='left').merge(books[['isbn', 'category', 'publisher', 'year_of_publication', 'book_author']], on='isbn', how='left')
-
-    column_list = ['location_city', 'location_state', 'location_country', 'age', 'book_author', \
-                        'year_of_publication', 'publisher', 'category']
-
-    columns = [column for column in column_list if train_df.iloc[0][column] != -1]
-
-    # 인덱싱 처리
-    loc_city2idx = {v:k for k,v in enumerate(context_df['location_city'].unique())}
-    loc_state2idx = {v:k for k,v in enumerate(context_df['location_state'].unique())}
-    loc_country2idx = {v:k for k,v in enumerate(context_df['location_country'].unique())}
-
-    train_df['location_city'] = train_df['location_city'].map(loc_city2idx)
-    train_df['location_state'] = train_df['location_state'].map(loc_state2idx)
-    train_df['location_country'] = train_df['location_country'].map(loc_country2idx)
-    test_df['location_city'] = test_df['location_city'].map(loc_city2idx)
-    test_df['location_state'] = test_df['location_state'].map(loc_state2idx)
-    test_df['location_country'] = test_df['location_country'].map(loc_country2idx)
-
-    train_df['age'] = train_df['age'].apply(age_map)
-    test_df['age'] = test_df['age'].apply(age_map)
-
-    # year of publication cases 4
-    train_df['year_of_publication'] = train_df['year_of_publication'].apply(year_of_publication_map)
-    test_df['year_of_publication'] = test_df['year_of_publication'].apply(year_of_publication_map)
-
-    # book 파트 인덱싱
-    category2idx = {v:k for k,v in enumerate(context_df['category'].unique())}
-    publisher2idx = {v:k for k,v in enumerate(context_df['publisher'].unique())}
-    author2idx = {v:k for k,v in enumerate(context_df['book_author'].unique())}
-
-    train_df['category'] = train_df['category'].map(category2idx)
-    train_df['publisher'] = train_df['publisher'].map(publisher2idx)
-    train_df['book_author'] = train_df['book_author'].map(author2idx)
-    test_df['category'] = test_df['category'].map(category2idx)
-    test_df['publisher'] = test_df['publisher'].map(publisher2idx)
-    test_df['book_author'] = test_df['book_author'].map(author2idx)
-
-    idx = {
-        "loc_city2idx":loc_city2idx,
-        "loc_state2idx":loc_state2idx,
-        "loc_country2idx":loc_country2idx,
-        "category2idx":category2idx,
-        "publisher2idx":publisher2idx,
-        "author2idx":author2idx,
-    }
-
-    length_db = {'age':6, 'year_of_publication': 4, 
-                'location_city': len(idx['loc_city2idx']), 'location_state': len(idx['loc_state2idx']), 
-                'location_country': len(idx['loc_country2idx']), 'category': len(idx['category2idx']), 'publisher': len(idx['publisher2idx']),
-                'book_author': len(idx['author2idx'])}
-    field_dims = [length_db[column] for column in columns]
-
-    return idx, train_df, test_df, columns, field_dims
-
-
-def process_text_data(df, user2idx, isbn2idx, device, train=False):
-    # df_ = df.copy()
-    print('Check Vectorizer')
+def text_vector_tables(encoder, train=False) -> dict:
+    """
+    DeepCoNN 의 user / item embedding 행렬을 한 번만 tensor 로 들고, 인코딩된 id -> 행 번호 table 을 만듭니다.
+    embedding 이 없는 id 는 마지막 0 벡터 행을 가리킵니다.
+    return: {batch 의 key: (id 컬럼, 행 번호 table, (N + 1, dim) 행렬)}
+    """
     print('Vector Load')
-    print("[USER]")
-    if train == True:
-        user = np.load('/opt/ml/data/embedding/train/user_summary_merge_vector.npy', allow_pickle = True)
-    else:
-        user = np.load('/opt/ml/data/embedding/test/user_summary_merge_vector.npy', allow_pickle = True)
-    user_review_text_df = pd.DataFrame([user[0], user[1]]).T
-    user_review_text_df.columns = ['user_id', 'user_summary_merge_vector']
-    user_review_text_df['user_id'] = user_review_text_df['user_id'].map(user2idx)
-    df = pd.merge(df, user_review_text_df, on='user_id', how='left')
-    del user
-    del user_review_text_df
-
-    print("[ITEM]")
-    if train == True:
-        item = np.load('/opt/ml/data/embedding/train/item_summary_vector.npy', allow_pickle = True)
-    else:
-        item = np.load('/opt/ml/data/embedding/test/item_summary_vector.npy', allow_pickle = True)
-    books_text_df = pd.DataFrame([item[0], item[1]]).T
-    books_text_df.columns = ['isbn', 'item_summary_vector']
-    books_text_df['isbn'] = books_text_df['isbn'].map(isbn2idx)
-    del item
-    df = pd.merge(df, books_text_df[['isbn', 'item_summary_vector']], on='isbn', how='left')
-    del books_text_df
-
-    # book_title
-    if train == True:
-        item = np.load('/opt/ml/data/embedding/train/book_title_vector.npy', allow_pickle = True)
-    else:
-        item = np.load('/opt/ml/data/embedding/test/book_title_vector.npy', allow_pickle = True)
-    books_text_df = pd.DataFrame([item[0], item[1]]).T
-    books_text_df.columns = ['isbn', 'item_title_vector']
-    books_text_df['isbn'] = books_text_df['isbn'].map(isbn2idx)
-    del item
-    df = pd.merge(df, books_text_df[['isbn', 'item_title_vector']], on='isbn', how='left')
-    
-    #image
-    if train == True:
-        item = np.load('/opt/ml/data/embedding/train/image_embed.npy', allow_pickle = True)
-    else:
-        item = np.load('/opt/ml/data/embedding/test/image_embed.npy', allow_pickle = True)
-    books_text_df = pd.DataFrame([item[0], item[1]]).T
-    books_text_df.columns = ['isbn', 'item_image_vector']
-    books_text_df['isbn'] = books_text_df['isbn'].map(isbn2idx)
-    del item
-    df = pd.merge(df, books_text_df[['isbn', 'item_image_vector']], on='isbn', how='left')
+    save_dir = os.path.join(EMBEDDING_DIR, 'train' if train else 'test')
+    tables = {}
+    for key, name, column in TEXT_VECTORS:
+        print(f"[{column}]")
+        ids, vectors = load_embedding(save_dir, name)
+        matrix = torch.from_numpy(np.concatenate([vectors, np.zeros((1, vectors.shape[1]), dtype=np.float32)]))
 
-
-    return df
+        codes = encoder.transform(key, ids)
+        found = np.flatnonzero(codes != -1)
+        table = torch.full((encoder.size(key),), len(ids), dtype=torch.long)
+        table[torch.from_numpy(codes[found]).long()] = torch.from_numpy(found)
+        tables[column] = (key, table.share_memory_(), matrix.share_memory_())
+    return tables
 
 
 class Text_Dataset(Dataset):
-    def __init__(self, user_isbn_vector, user_summary_merge_vector, item_summary_vector, item_title_vector, item_image_vector, label):
-        self.user_isbn_vector = user_isbn_vector
-        self.user_summary_merge_vector = user_summary_merge_vector
-        self.item_summary_vector = item_summary_vector
-        self.item_title_vector = item_title_vector
-        self.item_image_vector = item_image_vector
-        self.label = label
+    """
+    행마다 user_id / isbn (+ context) 와 label 만 들고, embedding 은 text_vector_tables 의 행렬을 같이 씁니다.
+    __getitem__ 은 행 번호만 돌려주고, collate 에서 modality 별로 index_select 한 번씩 batch 를 만듭니다.
+    """
+    def __init__(self, user_isbn_vector, label, vectors, columns):
+        self.user_isbn_vector = as_rows(user_isbn_vector)
+        self.label = torch.tensor(np.asarray(label), dtype=torch.float32)
+        self.vectors = vectors
+        self.key_position = {key: columns.index(key) for key in ('user_id', 'isbn')}
 
     def __len__(self):
         return self.user_isbn_vector.shape[0]
 
     def __getitem__(self, i):
-        return {
-                'user_isbn_vector' : torch.tensor(self.user_isbn_vector[i], dtype=torch.long),
-                'user_summary_merge_vector' : torch.tensor(self.user_summary_merge_vector[i].reshape(-1, 1), dtype=torch.float32),
-                'item_summary_vector' : torch.tensor(self.item_summary_vector[i].reshape(-1, 1), dtype=torch.float32),
-                'item_title_vector' : torch.tensor(self.item_title_vector[i].reshape(-1, 1), dtype=torch.float32),
-                'item_image_vector': torch.tensor(self.item_image_vector[i].reshape(-1, 1), dtype=torch.float32),
-                'label' : torch.tensor(self.label[i], dtype=torch.float32),
-                }
-
+        return i
 
-def text_data_load(args):
+    def collate(self, batch):
+        index = torch.as_tensor(batch, dtype=torch.long)
+        user_isbn_vector = self.user_isbn_vector[index]
+        fields = {'user_isbn_vector': user_isbn_vector}
+        for column, (key, table, matrix) in self.vectors.items():
+            rows = table[user_isbn_vector[:, self.key_position[key]].long()]
+            fields[column] = matrix.index_select(0, rows).unsqueeze(-1)
+        fields['label'] = self.label[index]
+        return fields
 
-    formatted_user_num = format(args.USER_NUM, '02')
-    formatted_book_num = format(args.BOOK_NUM, '02')
-    users = pd.read_csv(args.DATA_PATH + 'users/' + f'u{formatted_user_num}.csv')
-    books = pd.read_csv(args.DATA_PATH + 'books/' + f'b{formatted_book_num}.csv')
-    train = pd.read_csv(args.DATA_PATH + 'ratings/' + 'train_ratings.csv')
-    test = pd.read_csv(args.DATA_PATH + 'ratings/' + 'test_ratings.csv')
-    sub = pd.read_csv(args.DATA_PATH + 'ratings/' + 'sample_submission.csv')
 
-    ids = pd.concat([train['user_id'], sub['user_id']]).unique()
-    isbns = pd.concat([train['isbn'], sub['isbn']]).unique()
+def text_frame(context, ratings, columns) -> pd.DataFrame:
+    # test 평점 행에는 rating 이 없으므로 0 으로 채움
+    return context.frame(ratings).reindex(columns=columns, fill_value=0)
 
-    idx2user = {idx:id for idx, id in enumerate(ids)}
-    idx2isbn = {idx:isbn for idx, isbn in enumerate(isbns)}
 
-    user2idx = {id:idx for idx, id in idx2user.items()}
-    isbn2idx = {isbn:idx for idx, isbn in idx2isbn.items()}
+def text_vectors(encoder) -> LazyData:
+    """
+    {'train', 'test'} embedding table. test 는 처음 쓸 때 읽습니다.
+    """
+    print("[TEXT TRAIN]")
+    vectors = LazyData({'train': text_vector_tables(encoder, train=True)})
+    return vectors.lazy('test', text_vector_tables, encoder, False)
 
-    train['user_id'] = train['user_id'].map(user2idx)
-    sub['user_id'] = sub['user_id'].map(user2idx)
-    test['user_id'] = test['user_id'].map(user2idx)
-    users['user_id'] = users['user_id'].map(user2idx)
 
-    train['isbn'] = train['isbn'].map(isbn2idx)
-    sub['isbn'] = sub['isbn'].map(isbn2idx)
-    test['isbn'] = test['isbn'].map(isbn2idx)
-    books['isbn'] = books['isbn'].map(isbn2idx)
+def text_inputs(data: dict) -> dict:
+    """
+    context_inputs 에 ContextTable 로 펼친 text_train 과 그 컬럼 목록을 더합니다.
+    """
+    context = data['context']
+    context_train = context.frame(data['train'])
 
-    idx, context_train, context_test, columns, field_dims = process_context_data(users, books, train, test)
 
+    columns = ['user_id', 'isbn'] + context.columns
+    text_train = context_train[columns + ['rating']]
 
-    print("[TEXT TRAIN]")
-    text_train = process_text_data(context_train, user2idx, isbn2idx, args.DEVICE, train=True)
-    print("[TEXT TEST]")
-    text_test = process_text_data(context_test, user2idx, isbn2idx, args.DEVICE, train=False)
+    print(text_train.info(), '\n\n')
+    data['text_train'] = text_train
+    data['columns'] = columns
+    return data
 
-    columns = ['user_id', 'isbn'] + columns
-    field_dims = np.array([len(user2idx), len(isbn2idx)] + field_dims, dtype = np.int64)
-    text_train = text_train[columns + ['user_summary_merge_vector', 'item_summary_vector'] + ['item_title_vector', 'item_image_vector'] + ['rating']]
-    text_test = text_test[columns + ['user_summary_merge_vector', 'item_summary_vector'] + ['item_title_vector', 'item_image_vector'] + ['rating']]
 
-    print(text_train.info(), '\n\n')
-    print(text_test.info())
-    data = {
-            'train':train,
-            'test':test,
-            'users':users,
-            'books':books,
-            'sub':sub,
-            'idx2user':idx2user,
-            'idx2isbn':idx2isbn,
-            'user2idx':user2idx,
-            'isbn2idx':isbn2idx,
-            'text_train':text_train,
-            'text_test':text_test,
-            'field_dims': field_dims,
-            'columns': columns,
-            }
+def text_data_load(args):
+    """
+    text_test 와 test embedding table 은 처음 쓸 때 (test 예측) 만듭니다.
+    --DATA_SERVER 가 떠 있으면 서버의 context_inputs 로 만들고, 아니면 캐시를 씁니다.
+    """
+    data = shared_inputs(args)
+    if data is not None:
+        data = text_inputs(data)
+    else:
+        data = load_cached(args, 'text')
+        if data is None:
+            data = text_inputs(context_inputs(args))
+            save_cached(args, 'text', data)
 
-    return data
+    # embedding 은 store 에서 memory map 으로 바로 열리므로 캐시하지 않고 다시 엶
+    data = LazyData(data)
+    data['text_vectors'] = text_vectors(data['encoder'])
+    return data.lazy('text_test', text_frame, data['context'], data['test'], data['columns'] + ['rating'])
 
 
 def text_data_split(args, data):
@@ -288,55 +174,42 @@ def text_data_split(args, data):
 
 
 def text_data_loader(args, data):
-    rating_values = data['y_train'].values
-    class_list = np.array([])
-    for item in range(len(rating_values)):
-        class_list = np.append(class_list, item)
-
-    class_list = class_list.astype(np.uint8)
-    unique, count = np.unique(class_list, return_counts = True)
-    class_weights = [sum(count) / c for c in count]
-    sampler_list = [class_weights[e] for e in class_list]
-    sampler_train = WeightedRandomSampler(sampler_list, len(sampler_list), replacement = True)
-
     if args.CLASSIFIER:
         diff = 1
     else:
         diff = 0
     train_dataset = Text_Dataset(
                                 data['X_train'][data['columns']].values,
-                                data['X_train']['user_summary_merge_vector'].values,
-                                data['X_train']['item_summary_vector'].values,
-                                data['X_train']['item_title_vector'].values,
-                                data['X_train']['item_image_vector'].values,
-                                data['y_train'].values - diff
+                                data['y_train'].values - diff,
+                                data['text_vectors']['train'],
+                                data['columns']
                                 )
     valid_dataset = Text_Dataset(
                                 data['X_valid'][data['columns']].values,
-                                data['X_valid']['user_summary_merge_vector'].values,
-                                data['X_valid']['item_summary_vector'].values,
-                                data['X_valid']['item_title_vector'].values,
-                                data['X_valid']['item_image_vector'].values,
-                                data['y_valid'].values - diff
+                                data['y_valid'].values - diff,
+                                data['text_vectors']['train'],
+                                data['columns']
                                 )
-    test_dataset = Text_Dataset(
-                                data['text_test'][data['columns']].values,
-                                data['text_test']['user_summary_merge_vector'].values,
-                                data['text_test']['item_summary_vector'].values,
-                                data['text_test']['item_title_vector'].values,
-                                data['text_test']['item_image_vector'].values,
-                                data['text_test']['rating'].values - diff
-                                )
-    
 
     #train_dataloader = torch.utils.data.DataLoader(train_dataset, batch_size=args.BATCH_SIZE, shuffle=True, num_workers = 4)
     if args.WEIGHTED_SAMPLER:
-        train_dataloader = DataLoader(train_dataset, batch_size=args.BATCH_SIZE, sampler = sampler_train, num_workers = 4)
+        sampler = WeightedBatchSampler(data['y_train'].values, args.BATCH_SIZE)
+        train_dataloader = DataLoader(train_dataset, batch_sampler = sampler, num_workers = 4, collate_fn=train_dataset.collate)
     else:
-        train_dataloader = DataLoader(train_dataset, batch_size=args.BATCH_SIZE, shuffle = args.DATA_SHUFFLE, num_workers = 4)
+        train_dataloader = DataLoader(train_dataset, batch_size=args.BATCH_SIZE, shuffle = args.DATA_SHUFFLE, num_workers = 4, collate_fn=train_dataset.collate)
 
-    valid_dataloader = torch.utils.data.DataLoader(valid_dataset, batch_size=args.BATCH_SIZE, shuffle=True, num_workers = 4)
-    test_dataloader = torch.utils.data.DataLoader(test_dataset, batch_size=args.BATCH_SIZE, shuffle=False, num_workers = 4)
-    data['train_dataloader'], data['valid_dataloader'], data['test_dataloader'] = train_dataloader, valid_dataloader, test_dataloader
+    valid_dataloader = torch.utils.data.DataLoader(valid_dataset, batch_size=args.BATCH_SIZE, shuffle=True, num_workers = 4, collate_fn=valid_dataset.collate)
+    data['train_dataloader'], data['valid_dataloader'] = train_dataloader, valid_dataloader
+    data.lazy('test_dataloader', text_test_dataloader, args, data.ref('text_test'), data['text_vectors'].ref('test'), data['columns'], diff)
 
     return data
+
+
+def text_test_dataloader(args, text_test, vectors, columns, diff):
+    test_dataset = Text_Dataset(
+                                text_test[columns].values,
+                                text_test['rating'].values - diff,
+                                vectors,
+                                columns
+                                )
+    return torch.utils.data.DataLoader(test_dataset, batch_size=args.BATCH_SIZE, shuffle=False, num_workers = 4, collate_fn=test_dataset.collate)
@@ -174,8 +174,10 @@ class FeaturesEmbedding(nn.Module):
 
     def forward(self, x: torch.Tensor):
         """
-        :param x: Long tensor of size ``(batch_size, num_fields)``
+        :param x: Integer tensor of size ``(batch_size, num_fields)``
         """
+        # loader 는 가장 작은 정수 dtype 으로 넘기므로 lookup 직전에 long 으로 넓힘
+        x = x.long()
         x = x + x.new_tensor(self.offsets).unsqueeze(0)
         return self.embedding(x)
 
@@ -189,8 +191,9 @@ class FeaturesLinear(nn.Module):
 
     def forward(self, x: torch.Tensor):
         """
-        :param x: Long tensor of size ``(batch_size, num_fields)``
+        :param x: Integer tensor of size ``(batch_size, num_fields)``
         """
+        x = x.long()
         x = x + x.new_tensor(self.offsets).unsqueeze(0)
         return torch.sum(self.fc(x), dim=1) + self.bias
 
@@ -233,9 +236,10 @@ class FieldAwareFactorizationMachine(nn.Module):
 
     def forward(self, x: torch.Tensor):
         """
-        :param x: Long tensor of size ``(batch_size, num_fields)``
+        :param x: Integer tensor of size ``(batch_size, num_fields)``
         """
-        x = x + x.new_tensor(self.offsets, dtype= np.long).unsqueeze(0)
+        x = x.long()
+        x = x + x.new_tensor(self.offsets).unsqueeze(0)
         xs = [self.embeddings[i](x) for i in range(self.num_fields)]
         ix = list()
         for i in range(self.num_fields - 1):
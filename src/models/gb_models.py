@@ -38,10 +38,10 @@ class XGBoostModel:
                ## 리그레션 일 시 클래시파이어 일시 달라짐
         if cf:
             self.learning_rate = args.CF_LR
-            self.model = XGBClassifier(learning_rate = self.learning_rate, max_depth = self.max_depth)
+            self.model = XGBClassifier(learning_rate = self.learning_rate, max_depth = self.max_depth, n_jobs = args.NUM_THREADS)
         else:
             self.learning_rate = args.RR_LR
-            self.model = XGBRegressor(learning_rate = self.learning_rate, max_depth = self.max_depth)
+            self.model = XGBRegressor(learning_rate = self.learning_rate, max_depth = self.max_depth, n_jobs = args.NUM_THREADS)
 
 
 
@@ -114,10 +114,10 @@ class LightGBMModel:
         ## 리그레션 일 시 클래시파이어 일시 달라짐
         if cf:
             self.learning_rate = args.CF_LR
-            self.model = LGBMClassifier(learning_rate = self.learning_rate)
+            self.model = LGBMClassifier(learning_rate = self.learning_rate, n_jobs = args.NUM_THREADS)
         else:
             self.learning_rate = args.RR_LR
-            self.model = LGBMRegressor(learning_rate = self.learning_rate)
+            self.model = LGBMRegressor(learning_rate = self.learning_rate, n_jobs = args.NUM_THREADS)
 
 
     def train(self, fold_num):
@@ -191,10 +191,10 @@ class CatBoostModel:
         ## 리그레션 일 시 클래시파이어 일시 달라짐
         if cf:
             self.learning_rate = args.CF_LR
-            self.model = CatBoostClassifier(learning_rate = self.learning_rate, verbose=200)
+            self.model = CatBoostClassifier(learning_rate = self.learning_rate, verbose=200, thread_count = args.NUM_THREADS)
         else:
             self.learning_rate = args.RR_LR
-            self.model = CatBoostRegressor(learning_rate = self.learning_rate, verbose=200)
+            self.model = CatBoostRegressor(learning_rate = self.learning_rate, verbose=200, thread_count = args.NUM_THREADS)
 
     def train(self, fold_num):
         X, y = self.train_data
@@ -52,7 +52,7 @@ class CNN_FM:
         self.args = args
         self.device = args.DEVICE
         self.model = _CNN_FM(
-                            np.array([len(data['user2idx']), len(data['isbn2idx'])], dtype=np.uint32),
+                            data['field_dims'],
                             args.CNN_FM_EMBED_DIM,
                             args.CNN_FM_LATENT_DIM
                             ).to(self.device)
@@ -2,6 +2,7 @@ import os
 import random
 import numpy as np
 import torch
+import torch.multiprocessing as mp
 from sklearn.model_selection import train_test_split
 from pathlib import Path
 
@@ -14,6 +15,50 @@ def seed_everything(seed):
     torch.backends.cudnn.deterministic = True
 
 
+FOLD_JOB = {}
+THREAD_ENV = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS')
+
+
+def _fold_init(fold_fn, args, data, plan, num_threads):
+    # worker 마다 한 번: data 의 tensor 는 shared memory handle 로 넘어오고, thread 수는 나눠서 씀
+    for name in THREAD_ENV:
+        os.environ[name] = str(num_threads)
+    torch.set_num_threads(num_threads)
+    # GBM 은 args.NUM_THREADS 를 n_jobs / thread_count 로 씀
+    args.NUM_THREADS = num_threads
+    FOLD_JOB.update(fn=fold_fn, args=args, data=data, plan=plan)
+
+
+def _fold_run(idx):
+    return run_fold(FOLD_JOB['fn'], FOLD_JOB['args'], FOLD_JOB['data'], FOLD_JOB['plan'], idx)
+
+
+def run_fold(fold_fn, args, data, plan, idx):
+    # N_JOBS 와 상관없이 fold 마다 같은 seed 로 시작
+    seed_everything(args.SEED + idx)
+    train_index, valid_index = plan.fold_index(idx)
+    return fold_fn(args, data, idx, train_index, valid_index)
+
+
+def run_folds(args, data, plan, fold_fn) -> list:
+    """
+    plan(FoldPlan) 의 fold 마다 seed 를 SEED + fold 로 맞추고 fold_fn(args, data, idx, train_index, valid_index) 를 실행해서
+    결과를 fold 순서대로 돌려줍니다. (fold_fn 은 main 모듈의 함수여야 process 로 넘길 수 있음)
+    args.N_JOBS > 1 이면 forkserver process pool 에서 fold 를 동시에 학습합니다. N_JOBS 는 걸리는 시간만 바꿉니다.
+    data 는 tensor 만 담은 작은 dict 로 넘기면 (main.fold_data) tensor 는 복사 없이 shared memory 로 넘어갑니다.
+    process 마다 torch / OpenMP / MKL thread 와 GBM 의 thread 는 cpu 수 // N_JOBS 로 나눕니다.
+    (fork 는 부모가 이미 OpenMP thread 를 쓴 뒤라 자식에서 멈출 수 있어서 쓰지 않습니다.)
+    """
+    n_jobs = min(args.N_JOBS, len(plan))
+    if n_jobs <= 1:
+        return [run_fold(fold_fn, args, data, plan, idx) for idx in range(len(plan))]
+
+    num_threads = max(1, (os.cpu_count() or 1) // n_jobs)
+    print(f'[FOLD POOL] {n_jobs} processes x {num_threads} threads')
+    ctx = mp.get_context('forkserver')
+    with ctx.Pool(n_jobs, initializer=_fold_init, initargs=(fold_fn, args, data, plan, num_threads)) as pool:
+        return pool.map(_fold_run, range(len(plan)), chunksize=1)
+
 class EarlyStopping:
     def __init__(self, args, fold_num, verbose=False, delta=0):
         self.args = args
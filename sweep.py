@@ -0,0 +1,123 @@
+###############
+# USER_NUM x BOOK_NUM 경우의 수를 process pool 에서 한 번에 돌리는 sweep.
+# experiments/*.sh 처럼 경우의 수마다 python main.py 를 새로 띄우지 않고, worker process 마다
+# torch / 모델 import 와 base 테이블 읽기를 한 번만 하고 경우의 수는 메모리에서 골라 만듭니다.
+# 끝나는 순서대로 결과(variant, model, rmse, 시간)를 --RESULTS csv 에 한 줄씩 씁니다.
+# ex) python sweep.py --MODELS NCF --N_WORKERS 4
+# ex) python sweep.py --MODELS FM FFM --USER_NUMS 1 4 --BOOK_NUMS 1 5 10 -- --EPOCHS 5 --DEVICE cpu
+#     (-- 뒤는 main.py 옵션)
+
+import os
+import csv
+import sys
+import time
+import argparse
+import traceback
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import torch
+
+from main import get_parser
+from src import seed_everything
+from src.data import context_data_load, context_data_split, context_data_loader
+from src.data import dl_data_load, dl_data_split, dl_data_loader
+from src.data.store import cache_frames
+from src import FactorizationMachineModel, FieldAwareFactorizationMachineModel
+from src import NeuralCollaborativeFiltering, WideAndDeepModel, DeepCrossNetworkModel
+
+PIPELINES = {
+    'FM': (context_data_load, context_data_split, context_data_loader, FactorizationMachineModel),
+    'FFM': (context_data_load, context_data_split, context_data_loader, FieldAwareFactorizationMachineModel),
+    'NCF': (dl_data_load, dl_data_split, dl_data_loader, NeuralCollaborativeFiltering),
+    'WDN': (dl_data_load, dl_data_split, dl_data_loader, WideAndDeepModel),
+    'DCN': (dl_data_load, dl_data_split, dl_data_loader, DeepCrossNetworkModel),
+}
+RESULT_COLUMNS = ['variant', 'model', 'user_num', 'book_num', 'rmse', 'seconds', 'error']
+
+
+def mem_available_gb() -> float:
+    """
+    /proc/meminfo 의 MemAvailable (GB). 읽을 수 없으면 제한 없음.
+    """
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) / 1024 ** 2
+    except OSError:
+        pass
+    return float('inf')
+
+
+def init_worker(num_threads):
+    # worker 안에서 읽은 base / ratings 테이블은 다음 경우의 수에서 다시 씀
+    cache_frames()
+    torch.set_num_threads(num_threads)
+
+
+def run_variant(main_argv, model_name, user_num, book_num) -> dict:
+    """
+    main.py 의 --VALID random 과 같은 순서로 한 경우의 수를 학습하고 valid rmse 를 돌려줍니다. (submission 은 저장하지 않음)
+    """
+    start = time.time()
+    row = {'variant': f'u{user_num:02d}_b{book_num:02d}', 'model': model_name,
+           'user_num': user_num, 'book_num': book_num, 'rmse': '', 'error': ''}
+    try:
+        args = get_parser().parse_args(main_argv + ['--MODEL', model_name, '--USER_NUM', str(user_num),
+                                                    '--BOOK_NUM', str(book_num), '--VALID', 'random'])
+        seed_everything(args.SEED)
+        data_load, data_split, data_loader, model_class = PIPELINES[model_name]
+        data = data_loader(args, data_split(args, data_load(args)))
+        model = model_class(args, data)
+        row['rmse'] = float(model.train(fold_num = 0))
+    except Exception:
+        row['error'] = traceback.format_exc().strip().splitlines()[-1]
+        traceback.print_exc()
+    row['seconds'] = round(time.time() - start, 1)
+    return row
+
+
+def sweep(sweep_args, main_argv):
+    jobs = [(model_name, user_num, book_num) for model_name in sweep_args.MODELS
+            for user_num in sweep_args.USER_NUMS for book_num in sweep_args.BOOK_NUMS]
+    n_workers = max(1, min(sweep_args.N_WORKERS, len(jobs)))
+    num_threads = max(1, (os.cpu_count() or 1) // n_workers)
+    print(f'[SWEEP] {len(jobs)} runs, {n_workers} workers x {num_threads} threads -> {sweep_args.RESULTS}')
+
+    new_file = not os.path.exists(sweep_args.RESULTS)
+    with open(sweep_args.RESULTS, 'a', newline='') as f, \
+            ProcessPoolExecutor(n_workers, mp_context=mp.get_context('forkserver'),
+                                initializer=init_worker, initargs=(num_threads,)) as pool:
+        writer = csv.DictWriter(f, fieldnames=RESULT_COLUMNS)
+        if new_file:
+            writer.writeheader()
+
+        pending, running = list(jobs), set()
+        while pending or running:
+            # 메모리가 RUN_MEMORY_GB 보다 적게 남았으면 실행 중인 run 이 끝날 때까지 새 run 을 넣지 않음
+            while pending and len(running) < n_workers \
+                    and (not running or mem_available_gb() >= sweep_args.RUN_MEMORY_GB):
+                running.add(pool.submit(run_variant, main_argv, *pending.pop(0)))
+            done, running = wait(running, timeout=30, return_when=FIRST_COMPLETED)
+            for future in done:
+                row = future.result()
+                writer.writerow(row)
+                f.flush()
+                print(f"[SWEEP] {row['model']} {row['variant']} rmse: {row['rmse']} ({row['seconds']}s) {row['error']}")
+
+
+if __name__ == '__main__':
+    argv = sys.argv[1:]
+    main_argv = argv[argv.index('--') + 1:] if '--' in argv else []
+    argv = argv[:argv.index('--')] if '--' in argv else argv
+
+    parser = argparse.ArgumentParser(description='USER_NUM x BOOK_NUM sweep')
+    arg = parser.add_argument
+    arg('--MODELS', type=str, nargs='+', default=['NCF'], choices=list(PIPELINES), help='돌릴 모델들입니다.')
+    arg('--USER_NUMS', type=int, nargs='+', default=list(range(1, 10)), help='user data preprocessed number `1 ~ 9`')
+    arg('--BOOK_NUMS', type=int, nargs='+', default=list(range(1, 25)), help='book data preprocessed number `1 ~ 24`')
+    arg('--N_WORKERS', type=int, default=4, help='동시에 돌릴 run(process) 수입니다.')
+    arg('--RUN_MEMORY_GB', type=float, default=4.0, help='run 하나를 새로 시작할 때 남아 있어야 하는 메모리(GB)입니다.')
+    arg('--RESULTS', type=str, default='sweep_results.csv', help='결과를 이어 쓸 csv 경로입니다.')
+    sweep(parser.parse_args(argv), main_argv)